@@ -0,0 +1,234 @@
+from collections import deque
+
+import numpy as np
+
+
+def estimate_offset(reference, signal, max_lag=None):
+    """
+    Estimate the lag of a signal against a reference by FFT based cross-correlation.
+    :param reference: The reference samples.
+    :param signal: The samples of the same reference signal, as captured by another device.
+    :param max_lag: (OPTIONAL) Only consider lags up to this number of samples in both directions.
+                    Default: None (all lags)
+    :return: The lag in samples with sub sample resolution: signal[i + lag] corresponds to reference[i].
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    signal = np.asarray(signal, dtype=np.float64)
+    reference = reference - reference.mean()
+    signal = signal - signal.mean()
+    nfft = 1 << (len(reference) + len(signal) - 1).bit_length()
+    correlation = np.fft.irfft(np.fft.rfft(signal, nfft) * np.conj(np.fft.rfft(reference, nfft)), nfft)
+    # reorder from the circular layout to the lags -(len(reference) - 1) .. len(signal) - 1
+    correlation = np.concatenate((correlation[nfft - len(reference) + 1:], correlation[:len(signal)]))
+    first_lag = 1 - len(reference)
+    if max_lag is not None:
+        low = max(0, -max_lag - first_lag)
+        high = min(len(correlation), max_lag - first_lag + 1)
+        correlation = correlation[low:high]
+        first_lag += low
+    peak = int(np.argmax(correlation))
+    delta = 0.0
+    if 0 < peak < len(correlation) - 1:
+        # parabolic interpolation around the peak
+        left, center, right = correlation[peak - 1:peak + 2]
+        curvature = left - 2 * center + right
+        if curvature:
+            delta = 0.5 * (left - right) / curvature
+    return first_lag + peak + delta
+
+
+def estimate_drift(reference, signal, window=0x10000, max_lag=None):
+    """
+    Estimate offset and drift between two long captures of the same reference signal. The lag is measured on
+    consecutive windows and a straight line is fitted through the results.
+    :param reference: The reference samples.
+    :param signal: The samples of the same reference signal, as captured by another device.
+    :param window: (OPTIONAL) The window length in samples. Default: 64 Ki samples
+    :param max_lag: (OPTIONAL) The largest initial offset in samples considered. Default: None (half a window)
+    :return: (offset, drift): signal[offset + (1 + drift) * i] corresponds to reference[i].
+    """
+    if max_lag is None:
+        max_lag = window // 2
+    offset = estimate_offset(reference[:window], signal[:window + max_lag], max_lag)
+    starts, positions = [], []
+    for start in range(0, len(reference) - window + 1, window):
+        position = int(round(np.polyval(fit, start) if positions else offset + start))
+        if position < 0 or position + window > len(signal):
+            continue
+        lag = estimate_offset(reference[start:start + window], signal[position:position + window], window // 4)
+        starts.append(start)
+        positions.append(position + lag)
+        fit = np.polyfit(starts, positions, 1) if len(starts) > 1 else (1.0, positions[0] - start)
+    if len(starts) < 2:
+        return offset, 0.0
+    slope, intercept = np.polyfit(starts, positions, 1)
+    return intercept, slope - 1
+
+
+class StreamAligner(object):
+    """
+    Puts the streams of several devices on the timeline of the first one. Each device captures the same reference
+    signal on one of its channels, e.g. the calibration output of one scope. The offset and drift of every stream
+    are measured incrementally by cross-correlating windows of the reference, and the streams are resampled onto
+    the first stream's sample positions by linear interpolation.
+    The reference must be unambiguous over the start skew of the devices: a periodic signal only works if its
+    period is longer than the skew, so prefer a low calibration frequency or an aperiodic signal.
+    """
+    def __init__(self, num_streams, num_channels=2, reference_channel=0, window=0x10000, max_lag=None, history=256):
+        """
+        :param num_streams: The number of devices.
+        :param num_channels: (OPTIONAL) The number of channels of each stream. Default: 2
+        :param reference_channel: (OPTIONAL) The channel carrying the reference signal. Default: 0 (CH1)
+        :param window: (OPTIONAL) The cross-correlation window in samples. Default: 64 Ki samples
+        :param max_lag: (OPTIONAL) The largest start skew in samples considered. Default: None (half a window)
+        :param history: (OPTIONAL) The number of windows the drift fit is based on. Default: 256
+        """
+        self.num_streams = num_streams
+        self.num_channels = num_channels
+        self.reference_channel = reference_channel
+        self.window = window
+        self.max_lag = window // 2 if max_lag is None else max_lag
+        # the samples of each stream are kept in the first lengths[stream] columns of a growing uint8 buffer
+        self.buffers = [np.empty((num_channels, window), dtype=np.uint8) for _ in range(num_streams)]
+        self.lengths = [0] * num_streams
+        # the sample index of the first buffered sample of each stream
+        self.bases = [0] * num_streams
+        # (sample index of the first stream, matching position in the stream) pairs
+        self.measurements = [deque(maxlen=history) for _ in range(num_streams)]
+        self.fits = [None] * num_streams
+        self.next_measurement = 0
+        self.output_index = 0
+
+    def push(self, stream, *channels):
+        """
+        Add samples of one stream. The arguments of a read_async callback can be passed on directly.
+        :param stream: The index of the stream.
+        :param channels: The samples of each channel, further arguments are ignored.
+        :return: None
+        """
+        channels = [np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+                    for data in channels[:self.num_channels]]
+        count = len(channels[0])
+        length = self.lengths[stream]
+        buffer = self.buffers[stream]
+        if length + count > buffer.shape[1]:
+            buffer = np.empty((self.num_channels, max(2 * buffer.shape[1], length + count)), dtype=np.uint8)
+            buffer[:, :length] = self.buffers[stream][:, :length]
+            self.buffers[stream] = buffer
+        for row, data in zip(buffer, channels):
+            row[length:length + count] = data
+        self.lengths[stream] += count
+        self.measure()
+
+    def samples(self, stream):
+        """
+        :return: A view of the buffered samples of the stream, shape (num_channels, N).
+        """
+        return self.buffers[stream][:, :self.lengths[stream]]
+
+    def get_model(self, stream):
+        """
+        :param stream: The index of the stream.
+        :return: (offset, drift): sample offset + (1 + drift) * i of the stream matches sample i of the first stream,
+                 or None if not measured yet.
+        """
+        if stream == 0:
+            return 0.0, 0.0
+        fit = self.fits[stream]
+        if fit is None:
+            return None
+        return fit[1], fit[0] - 1
+
+    def position(self, stream, index):
+        """
+        :return: The position in the stream matching the sample index (or array of indexes) of the first stream.
+        """
+        slope, intercept = self.fits[stream] if stream else (1.0, 0.0)
+        return intercept + slope * index
+
+    def end(self, stream):
+        """
+        :return: The sample index following the last received sample of the stream.
+        """
+        return self.bases[stream] + self.lengths[stream]
+
+    def measure(self):
+        """
+        Measure all streams against the first one, for each window of the first stream that is complete.
+        :return: None
+        """
+        window = self.window
+        while True:
+            start = self.next_measurement
+            if self.end(0) < start + window:
+                return
+            reference = self.samples(0)[self.reference_channel, start - self.bases[0]:start - self.bases[0] + window]
+            ranges = []
+            for stream in range(1, self.num_streams):
+                if self.fits[stream] is None:
+                    # the first measurement searches the whole skew range
+                    position, max_lag = start, self.max_lag
+                    low, high = max(start - max_lag, self.bases[stream]), start + window + max_lag
+                else:
+                    position, max_lag = int(round(self.position(stream, start))), window // 4
+                    low, high = max(position, self.bases[stream]), position + window
+                if self.end(stream) < high:
+                    return
+                ranges.append((stream, position, max_lag, low, high))
+            for stream, position, max_lag, low, high in ranges:
+                base = self.bases[stream]
+                signal = self.samples(stream)[self.reference_channel, low - base:high - base]
+                lag = estimate_offset(reference, signal, max_lag + position - low) + low - position
+                self.measurements[stream].append((start, position + lag))
+                starts, positions = zip(*self.measurements[stream])
+                if len(starts) > 1:
+                    self.fits[stream] = tuple(np.polyfit(starts, positions, 1))
+                else:
+                    self.fits[stream] = (1.0, positions[0] - starts[0])
+            self.next_measurement += window
+            self.trim()
+
+    def pull(self):
+        """
+        Take the aligned samples of all streams, as far as every stream has been received and measured.
+        :return: One float64 array of shape (num_channels, N) per stream, all on the sample positions of the first
+                 stream, N may be 0. The output starts where all streams have samples.
+        """
+        if None in self.fits[1:]:
+            return [np.empty((self.num_channels, 0)) for _ in range(self.num_streams)]
+        start = max(self.output_index, self.bases[0])
+        end = min(self.end(0), self.next_measurement)
+        for stream in range(1, self.num_streams):
+            slope, intercept = self.fits[stream]
+            # the first and last sample index of the first stream whose position is covered by this stream
+            start = max(start, int(np.ceil((self.bases[stream] - intercept) / slope)))
+            end = min(end, int((self.end(stream) - 1 - intercept) / slope))
+        end = max(start, end)
+        indexes = np.arange(start, end, dtype=np.float64)
+        aligned = []
+        for stream in range(self.num_streams):
+            buffer = self.samples(stream)
+            positions = self.position(stream, indexes) - self.bases[stream]
+            samples = np.arange(buffer.shape[1])
+            aligned.append(np.array([np.interp(positions, samples, row) for row in buffer]))
+        self.output_index = end
+        self.trim()
+        return aligned
+
+    def trim(self):
+        """
+        Drop the buffered samples no longer needed for measuring or output.
+        :return: None
+        """
+        keep = min(self.output_index, self.next_measurement)
+        for stream in range(self.num_streams):
+            if stream and self.fits[stream] is None:
+                continue
+            position = int(np.floor(self.position(stream, keep))) - (self.max_lag if stream else 0) - 1
+            length = self.lengths[stream]
+            drop = min(max(0, position - self.bases[stream]), length)
+            if drop:
+                buffer = self.buffers[stream]
+                buffer[:, :length - drop] = buffer[:, drop:length]
+                self.lengths[stream] -= drop
+                self.bases[stream] += drop
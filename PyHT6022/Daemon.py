@@ -0,0 +1,394 @@
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+import socketserver
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+from PyHT6022.LibUsbScope import Oscilloscope
+from PyHT6022.RingBuffer import RingBuffer
+
+
+# The shared memory starts with a header of int64 values, followed by the ring storage of RingBuffer.
+# The samples up to WRITE_INDEX are complete, the ones up to WRITE_END may be being written.
+HEADER_SIZE = 8
+WRITE_INDEX, RING_SIZE, NUM_CHANNELS, WRITE_END = range(4)
+
+
+def map_shared_ring(shm, size=None, num_channels=None):
+    """
+    Map the header and the ring storage of a shared memory block.
+    :param shm: The SharedMemory instance.
+    :param size: (OPTIONAL) The ring size to write to the header. Default: None (read it from the header)
+    :param num_channels: (OPTIONAL) The number of channels to write to the header. Default: None (read it)
+    :return: The header and the (num_channels, 2 * size) ring storage as numpy arrays.
+    """
+    header = np.ndarray(HEADER_SIZE, dtype=np.int64, buffer=shm.buf)
+    if size is not None:
+        header[:] = 0
+        header[RING_SIZE] = size
+        header[NUM_CHANNELS] = num_channels
+    size, num_channels = int(header[RING_SIZE]), int(header[NUM_CHANNELS])
+    storage = np.ndarray((num_channels, 2 * size), dtype=np.uint8, buffer=shm.buf, offset=header.nbytes)
+    return header, storage
+
+
+class SharedRingBuffer(RingBuffer):
+    """
+    A RingBuffer on shared memory, which publishes its write position in the header for the client processes.
+    """
+    def __init__(self, size, num_channels=2, policy=RingBuffer.DROP_OLDEST, name=None):
+        self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                              size=HEADER_SIZE * 8 + num_channels * 2 * size)
+        self.header, storage = map_shared_ring(self.shm, size, num_channels)
+        super(SharedRingBuffer, self).__init__(size, num_channels, policy, buffer=storage)
+
+    def write_chunk(self, channels):
+        # announce the samples about to be overwritten before touching them
+        self.header[WRITE_END] = self.write_index + len(channels[0])
+        count = super(SharedRingBuffer, self).write_chunk(channels)
+        # the samples are in place, now the clients may see them
+        self.header[WRITE_INDEX] = self.write_index
+        return count
+
+    def unlink(self):
+        """
+        Release and remove the shared memory block.
+        :return: None
+        """
+        self.header = self.buffer = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ScopeDaemon(object):
+    """
+    Owns the device and streams its samples into a shared memory ring, while accepting configuration commands from
+    local clients over a unix socket. Each request and response is one line of JSON, e.g.
+    {"command": "set_sample_rate", "args": [10]} answered by {"ok": true, "result": true}.
+    """
+    COMMANDS = ['set_sample_rate', 'set_ch1_voltage_range', 'set_ch2_voltage_range', 'set_ch1_ac_dc',
+                'set_ch2_ac_dc', 'set_ch1_ch2_ac_dc', 'set_calibration_frequency']
+
+    def __init__(self, socket_path, size=0x100000, num_channels=2, scope=None, name=None, sample_rate_index=None):
+        """
+        Create the daemon, the device is opened by start.
+        :param socket_path: The path of the unix control socket.
+        :param size: (OPTIONAL) The number of samples per channel held by the shared ring. Default: 1 Mi samples
+        :param num_channels: (OPTIONAL) The number of active channels. Default: 2
+        :param scope: (OPTIONAL) An Oscilloscope instance. Default: None (use the first device found)
+        :param name: (OPTIONAL) The name of the shared memory block. Default: None (choose one)
+        :param sample_rate_index: (OPTIONAL) The sample rate index to stream at. Default: None (keep the device's)
+        """
+        self.socket_path = socket_path
+        self.size = size
+        self.num_channels = num_channels
+        self.sample_rate_index = sample_rate_index
+        self.scope = scope or Oscilloscope()
+        self.name = name
+        self.ring = None
+        self.reader = None
+        self.server = None
+        self.lock = threading.Lock()
+
+    def start(self, cpus=None, priority=None):
+        """
+        Set up the device, the shared ring and the control socket, and start streaming.
+        :param cpus: (OPTIONAL) The CPUs to pin the event thread to. Default: None (leave it)
+        :param priority: (OPTIONAL) The SCHED_FIFO priority of the event thread. Default: None (normal scheduling)
+        :return: True if successful. May assert or raise various libusb errors if something went wrong.
+        """
+        scope = self.scope
+        assert scope.setup()
+        assert scope.open_handle()
+        if not scope.is_device_firmware_present:
+            assert scope.flash_firmware()
+        # the transfers are sized for the rate and channels in effect when reading starts
+        assert scope.set_num_channels(self.num_channels)
+        if self.sample_rate_index is not None:
+            assert scope.set_sample_rate(self.sample_rate_index)
+        self.ring = SharedRingBuffer(self.size, self.num_channels, name=self.name)
+        daemon = self
+
+        class ControlHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    self.wfile.write(json.dumps(daemon.handle_command(line)).encode() + b'\n')
+                    self.wfile.flush()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, ControlHandler)
+        self.server.daemon_threads = True
+        scope.start_capture()
+        self.start_reader()
+        scope.start_event_thread(cpus, priority)
+        return True
+
+    def start_reader(self):
+        """
+        Internal function starting to read into the shared ring, with transfers sized for the current settings.
+        """
+        self.reader = self.scope.read_async(self.ring, numpy=True)
+        self.scope.lock_reader_memory(self.reader, self.ring.buffer)
+
+    def set_sample_rate(self, rate_index):
+        """
+        Change the sample rate and restart reading, so the transfers are sized for the new rate. The samples taken
+        while the reader restarts are not written to the ring.
+        :param rate_index: See Oscilloscope.set_sample_rate.
+        :return: True if successful.
+        """
+        self.reader.stop(timeout=1)
+        result = self.scope.set_sample_rate(rate_index)
+        self.sample_rate_index = rate_index
+        self.start_reader()
+        return result
+
+    def handle_command(self, line):
+        """
+        Execute one control request.
+        :param line: The JSON encoded request.
+        :return: The response as dictionary.
+        """
+        try:
+            request = json.loads(line)
+            command = request['command']
+            if command == 'status':
+                return {'ok': True, 'result': self.status()}
+            if command not in self.COMMANDS:
+                return {'ok': False, 'error': 'unknown command {}'.format(command)}
+            # the sample rate is changed by the daemon itself, which restarts the reader
+            target = self if command == 'set_sample_rate' else self.scope
+            with self.lock:
+                result = getattr(target, command)(*request.get('args', []))
+            return {'ok': True, 'result': result}
+        except Exception as exception:
+            return {'ok': False, 'error': repr(exception)}
+
+    def status(self):
+        """
+        :return: The shared memory name, ring geometry, current settings, loss counters and the tuning applied to
+                 the event thread as dictionary.
+        """
+        scope = self.scope
+        tuning = dict(scope.event_thread.tuning_report or {})
+        if tuning.get('affinity'):
+            # sets are not JSON serializable
+            tuning['affinity'] = sorted(tuning['affinity'])
+        return {'name': self.ring.shm.name, 'size': self.size, 'num_channels': self.num_channels,
+                'sample_rate_index': scope.sample_rate_index, 'ac_dc_status': scope.ac_dc_status,
+                'write_index': self.ring.write_index, 'dropped_blocks': scope.dropped_blocks,
+                'packets_in_error': scope.packets_in_error, 'samples_lost': scope.samples_lost, 'tuning': tuning}
+
+    def serve_forever(self):
+        """
+        Handle control requests until shutdown is called.
+        :return: None
+        """
+        self.server.serve_forever()
+
+    def shutdown(self):
+        """
+        Stop streaming and the control socket, and release the device and the shared memory.
+        Must not be called from the thread running serve_forever.
+        :return: True if successful.
+        """
+        scope = self.scope
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            os.unlink(self.socket_path)
+            self.server = None
+        if self.reader:
+            scope.stop_capture()
+            self.reader.stop(timeout=1)
+            scope.stop_event_thread()
+            self.reader = None
+        scope.close_handle()
+        if self.ring:
+            self.ring.close()
+            self.ring.unlink()
+            self.ring = None
+        return True
+
+
+class ScopeClient(object):
+    """
+    Attaches to a running ScopeDaemon: reads zero copy sample windows from the shared ring and sends configuration
+    commands over the control socket.
+    """
+    def __init__(self, socket_path, poll_interval=0.001):
+        """
+        Connect to the daemon.
+        :param socket_path: The path of the daemon's unix control socket.
+        :param poll_interval: (OPTIONAL) How often read checks for new samples, in seconds. Default: 1 ms
+        """
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.stream = self.socket.makefile('rwb')
+        self.poll_interval = poll_interval
+        status = self.command('status')
+        try:
+            self.shm = shared_memory.SharedMemory(name=status['name'], track=False)
+        except TypeError:
+            # before Python 3.13 attaching registers the block for removal at exit, which is the daemon's job
+            self.shm = shared_memory.SharedMemory(name=status['name'])
+            resource_tracker.unregister('/' + self.shm.name, 'shared_memory')
+        self.header, self.buffer = map_shared_ring(self.shm)
+        self.size, self.num_channels = self.buffer.shape[1] // 2, self.buffer.shape[0]
+        self.read_index = int(self.header[WRITE_INDEX])
+        # samples overwritten by the daemon before this client read them
+        self.overwritten = 0
+        # the sample index and count of the window returned by the last read
+        self.last_read = (self.read_index, 0)
+
+    def command(self, command, *args):
+        """
+        Send a control request and wait for the response.
+        :param command: The command, "status" or one of ScopeDaemon.COMMANDS.
+        :param args: The arguments of the command.
+        :return: The result of the command. Asserts if the daemon reported an error.
+        """
+        self.stream.write(json.dumps({'command': command, 'args': args}).encode() + b'\n')
+        self.stream.flush()
+        response = json.loads(self.stream.readline())
+        assert response['ok'], response.get('error')
+        return response['result']
+
+    def set_sample_rate(self, rate_index):
+        """
+        See Oscilloscope.set_sample_rate, executed by the daemon.
+        """
+        return self.command('set_sample_rate', rate_index)
+
+    def set_ch1_voltage_range(self, range_index):
+        """
+        See Oscilloscope.set_ch1_voltage_range, executed by the daemon.
+        """
+        return self.command('set_ch1_voltage_range', range_index)
+
+    def set_ch2_voltage_range(self, range_index):
+        """
+        See Oscilloscope.set_ch2_voltage_range, executed by the daemon.
+        """
+        return self.command('set_ch2_voltage_range', range_index)
+
+    def set_ch1_ac_dc(self, ac_dc):
+        """
+        See Oscilloscope.set_ch1_ac_dc, executed by the daemon.
+        """
+        return self.command('set_ch1_ac_dc', ac_dc)
+
+    def set_ch2_ac_dc(self, ac_dc):
+        """
+        See Oscilloscope.set_ch2_ac_dc, executed by the daemon.
+        """
+        return self.command('set_ch2_ac_dc', ac_dc)
+
+    def write_index(self):
+        """
+        :return: The number of samples per channel written by the daemon so far.
+        """
+        return int(self.header[WRITE_INDEX])
+
+    def window(self, index, count):
+        """
+        Take a window of the shared ring.
+        :param index: The sample index of the first sample.
+        :param count: The number of samples per channel, at most the ring size.
+        :return: A zero copy view for each channel. The daemon overwrites it once it gets there, check
+                 lost(index, count) after using the samples, or copy them first.
+        """
+        assert count <= self.size
+        start = index % self.size
+        return tuple(row[start:start + count] for row in self.buffer)
+
+    def lost(self, index=None, count=None):
+        """
+        Check a window after its samples were used or copied.
+        :param index: (OPTIONAL) The sample index of the first sample. Default: None (the window of the last read)
+        :param count: (OPTIONAL) The number of samples per channel. Default: None (the window of the last read)
+        :return: The number of samples at the start of the window which the daemon has overwritten or is
+                 overwriting by now, 0 if the window is intact.
+        """
+        if index is None:
+            index, count = self.last_read
+        return max(0, min(count, int(self.header[WRITE_END]) - self.size - index))
+
+    def latest(self, count):
+        """
+        :param count: The number of samples per channel, at most the ring size.
+        :return: A zero copy view of the newest samples for each channel.
+        """
+        write_index = self.write_index()
+        count = min(count, write_index)
+        return self.window(write_index - count, count)
+
+    def read(self, count, timeout=None):
+        """
+        Wait for and consume the next samples. Samples overwritten before they were read are skipped and counted in
+        overwritten.
+        :param count: The number of samples per channel, at most the ring size.
+        :param timeout: (OPTIONAL) The timeout in seconds. Default: None (Wait forever)
+        :return: A zero copy view for each channel, or None on timeout. The daemon keeps writing, call lost() after
+                 using the samples to check that they were not overwritten meanwhile.
+        """
+        assert count <= self.size
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            while self.write_index() - self.read_index < count:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return None
+                time.sleep(self.poll_interval)
+            oldest = int(self.header[WRITE_END]) - self.size
+            if self.read_index >= oldest:
+                break
+            # skip what is overwritten already, then wait for count samples from there
+            self.overwritten += oldest - self.read_index
+            self.read_index = oldest
+        data = self.window(self.read_index, count)
+        self.last_read = (self.read_index, count)
+        self.read_index += count
+        return data
+
+    def close(self):
+        """
+        Detach from the daemon.
+        :return: None
+        """
+        self.header = self.buffer = None
+        self.shm.close()
+        self.stream.close()
+        self.socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream the samples of a Hantek 6022 into shared memory.')
+    parser.add_argument('-s', '--socket', default='/tmp/ht6022.sock', help='the control socket path')
+    parser.add_argument('-n', '--size', type=int, default=0x100000, help='the ring size in samples per channel')
+    parser.add_argument('-c', '--channels', type=int, default=2, choices=[1, 2], help='the number of channels')
+    parser.add_argument('-r', '--rate', type=int, default=None, help='the initial sample rate index')
+    parser.add_argument('--name', default=None, help='the name of the shared memory block')
+    parser.add_argument('--cpus', type=int, nargs='+', default=None, help='pin the event thread to these CPUs')
+    parser.add_argument('--priority', type=int, default=None, help='the SCHED_FIFO priority of the event thread')
+    args = parser.parse_args()
+    daemon = ScopeDaemon(args.socket, args.size, args.channels, name=args.name, sample_rate_index=args.rate)
+    daemon.start(args.cpus, args.priority)
+    print("Event thread tuning: {}".format(daemon.scope.event_thread.tuning_report))
+    print("Serving {} on {}".format(daemon.ring.shm.name, args.socket))
+    server_thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    server_thread.start()
+    try:
+        server_thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.shutdown()
+
+
+if __name__ == '__main__':
+    main()
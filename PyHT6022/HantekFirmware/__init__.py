@@ -2,7 +2,8 @@ __author__ = 'Robert Cope'
 
 from collections import namedtuple
 import os
-import array
+import struct
+import hashlib
 
 # Firmwares to bootstrap the Hantek 6022BE Device are located in this module.
 # Format: (Data Len, Value, Data) (Index is always 0x00).
@@ -20,14 +21,13 @@ def fx2_ihex_to_control_packets(firmware_location):
             record_len = int(line[1:3], 16)
             addr = int(line[3:7], 16)
             record_type = int(line[7:9], 16)
-            raw_data = line[9:-2]
-            record_data = [int(raw_data[i:i+2], 16) for i in range(0, len(raw_data), 2)]
+            record_data = bytes.fromhex(line[9:-2])
             file_checksum = int(line[-2:], 16)
             assert record_len == len(record_data)
             if record_type == 0x00:
                 checksum = (sum(record_data) + record_len + (addr % 256) + (addr >> 8)) % 256
                 assert not ((checksum + file_checksum) % 256) & 0xFF
-                packets.append(FirmwareControlPacket(record_len, addr, array.array('B', record_data).tostring()))
+                packets.append(FirmwareControlPacket(record_len, addr, record_data))
             elif record_type == 0x01:
                 assert file_checksum == 0xFF
                 break
@@ -37,11 +37,152 @@ def fx2_ihex_to_control_packets(firmware_location):
     packets.append(FirmwareControlPacket(1, 0xe600, b'\x00'))
     return packets
 
+
+# The FX2 CPU control and status register, the writes to it hold the 8051 in reset and release it again.
+CPUCS_ADDRESS = 0xe600
+# The largest control transfer usbfs accepts.
+MAX_CONTROL_SIZE = 4096
+
+
+def coalesce_control_packets(packets, max_size=MAX_CONTROL_SIZE):
+    """
+    Merge packets writing contiguous memory into as few packets as possible. The CPUCS writes stay on their own,
+    nothing is merged across them.
+    :param packets: The list of FirmwareControlPacket.
+    :param max_size: (OPTIONAL) The largest packet size. Default: 4096 bytes
+    :return: The merged list of FirmwareControlPacket.
+    """
+    merged = []
+    start, chunks, size = None, [], 0
+    for packet in packets:
+        if packet.value == CPUCS_ADDRESS or start is None or start + size != packet.value \
+                or size + packet.size > max_size:
+            if chunks:
+                merged.append(FirmwareControlPacket(size, start, b''.join(chunks)))
+            start, chunks, size = None, [], 0
+            if packet.value == CPUCS_ADDRESS:
+                merged.append(packet)
+                continue
+            start = packet.value
+        chunks.append(packet.data)
+        size += packet.size
+    if chunks:
+        merged.append(FirmwareControlPacket(size, start, b''.join(chunks)))
+    return merged
+
+
+IHEX_END_RECORD = ':00000001ff'
+
+
+def binary_to_ihex_records(data, address=0, record_len=16):
+    """
+    Encode memory contents as Intel hex data records. The records are built and checksummed as one array, and
+    hex encoded in one go.
+    :param data: The memory contents, a bytes-like object.
+    :param address: (OPTIONAL) The address of the first byte. Default: 0
+    :param record_len: (OPTIONAL) The number of data bytes per record, the last record may be shorter. Default: 16
+    :return: The list of record lines, without the end of file record.
+    """
+    # imported here, loading the firmware images does not need numpy
+    import numpy as np
+    data = np.frombuffer(data, dtype=np.uint8)
+    assert 0 < record_len <= 0xff and address + len(data) <= 0x10000
+    lines = []
+    full_len = len(data) - len(data) % record_len
+    # the full records, then the remainder as one short record
+    for start, size, count in ((0, record_len, full_len // record_len), (full_len, len(data) - full_len, 1)):
+        if not size or not count:
+            continue
+        records = np.zeros((count, size + 5), dtype=np.uint8)
+        addresses = address + start + np.arange(count) * size
+        records[:, 0] = size
+        records[:, 1] = addresses >> 8
+        records[:, 2] = addresses & 0xff
+        records[:, 4:-1] = data[start:start + count * size].reshape(count, size)
+        records[:, -1] = (0x100 - records[:, :-1].sum(axis=1) % 0x100) % 0x100
+        text = records.tobytes().hex()
+        width = 2 * (size + 5)
+        lines.extend(':' + text[position:position + width] for position in range(0, len(text), width))
+    return lines
+
+
+# The parsed packets are cached in a compact binary form: a magic, then per packet its size and value as
+# little endian 16 bit words followed by the data. The cache file is named after the hash of the hex file.
+CACHE_MAGIC = b'HT6022FW1\n'
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                         'PyHT6022')
+
+
+def packets_to_binary(packets):
+    return CACHE_MAGIC + b''.join(struct.pack('<HH', packet.size, packet.value) + packet.data for packet in packets)
+
+
+def binary_to_packets(binary):
+    assert binary.startswith(CACHE_MAGIC)
+    packets = []
+    position = len(CACHE_MAGIC)
+    while position < len(binary):
+        size, value = struct.unpack_from('<HH', binary, position)
+        position += 4
+        data = binary[position:position + size]
+        assert len(data) == size
+        packets.append(FirmwareControlPacket(size, value, data))
+        position += size
+    return packets
+
+
+def load_firmware(firmware_location, cache_dir=CACHE_DIR):
+    """
+    Load the control packets of an Intel hex firmware file, through the binary cache if possible.
+    :param firmware_location: The hex file.
+    :param cache_dir: (OPTIONAL) The cache directory, None disables the cache. Default: ~/.cache/PyHT6022
+    :return: The list of FirmwareControlPacket.
+    """
+    if cache_dir is None:
+        return fx2_ihex_to_control_packets(firmware_location)
+    with open(firmware_location, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    cache_file = os.path.join(cache_dir, digest + '.bin')
+    try:
+        with open(cache_file, 'rb') as f:
+            return binary_to_packets(f.read())
+    except (OSError, AssertionError, struct.error):
+        pass
+    packets = fx2_ihex_to_control_packets(firmware_location)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a private file first, so concurrent readers never see a partial cache file
+        temporary_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(temporary_file, 'wb') as f:
+            f.write(packets_to_binary(packets))
+        os.replace(temporary_file, cache_file)
+    except OSError:
+        pass # the cache is optional, e.g. on a read-only home directory
+    return packets
+
+
 base_path = os.path.dirname(os.path.realpath(__file__))
-stock_firmware = fx2_ihex_to_control_packets(os.path.join(base_path, 'stock', 'stock_fw.ihex'))
-mod_firmware_01 = fx2_ihex_to_control_packets(os.path.join(base_path, 'modded', 'mod_fw_01.ihex'))
-mod_firmware_iso = fx2_ihex_to_control_packets(os.path.join(base_path, 'modded', 'mod_fw_iso.ihex'))
-custom_firmware_BE = fx2_ihex_to_control_packets(os.path.join(base_path, 'DSO6022BE', 'dso6022be-firmware.hex'))
-custom_firmware_BL = fx2_ihex_to_control_packets(os.path.join(base_path, 'DSO6022BL', 'dso6022bl-firmware.hex'))
-custom_firmware_DDS = fx2_ihex_to_control_packets(os.path.join(base_path, 'DDS120', 'dds120-firmware.hex'))
-default_firmware = custom_firmware = custom_firmware_BE
+FIRMWARE_FILES = {
+    'stock_firmware': os.path.join(base_path, 'stock', 'stock_fw.ihex'),
+    'mod_firmware_01': os.path.join(base_path, 'modded', 'mod_fw_01.ihex'),
+    'mod_firmware_iso': os.path.join(base_path, 'modded', 'mod_fw_iso.ihex'),
+    'custom_firmware_BE': os.path.join(base_path, 'DSO6022BE', 'dso6022be-firmware.hex'),
+    'custom_firmware_BL': os.path.join(base_path, 'DSO6022BL', 'dso6022bl-firmware.hex'),
+    'custom_firmware_DDS': os.path.join(base_path, 'DDS120', 'dds120-firmware.hex'),
+}
+FIRMWARE_ALIASES = {'default_firmware': 'custom_firmware_BE', 'custom_firmware': 'custom_firmware_BE'}
+
+
+def __getattr__(name):
+    # the firmware images are only loaded on first use
+    target = FIRMWARE_ALIASES.get(name, name)
+    if target not in FIRMWARE_FILES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    if target not in globals():
+        globals()[target] = load_firmware(FIRMWARE_FILES[target], CACHE_DIR)
+    globals()[name] = globals()[target]
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(list(globals()) + list(FIRMWARE_FILES) + list(FIRMWARE_ALIASES))
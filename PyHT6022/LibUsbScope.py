@@ -1,15 +1,630 @@
 __author__ = 'Robert Cope', 'Jochen Hoenicke'
 
 import os
+import math
 import time
+import asyncio
 import usb1
 import array
+import queue
 import select
 import libusb1
+import weakref
+import warnings
 import threading
+import numpy as np
 from struct import pack
 
-from PyHT6022.HantekFirmware import custom_firmware_BE, custom_firmware_BL, fx2_ihex_to_control_packets
+from functools import partial
+from concurrent.futures import Future
+from collections import deque, namedtuple
+
+from PyHT6022.Timing import SampleClock
+from PyHT6022.Realtime import tune_current_thread, lock_memory
+# the firmware images are only loaded when needed for flashing
+from PyHT6022 import HantekFirmware
+
+# Metadata of a block delivered by read_async.
+# Format: (Index of first sample, Transfer sequence number, Completion time, Packet lengths,
+#          Number of failed packets, Number of short packets, Function returning a lent buffer to its pool).
+BlockInfo = namedtuple('BlockInfo', ['sample_index', 'sequence', 'timestamp', 'packet_lengths',
+                                     'failed_packets', 'short_packets', 'release'],
+                       defaults=(lambda: None,))
+# A configuration change during a read_async: the setting applies from sample_index on, it may already apply from
+# earliest_index on (the sample taken when the request was submitted).
+ConfigEvent = namedtuple('ConfigEvent', ['sample_index', 'earliest_index', 'setting', 'value', 'submitted',
+                                         'completed'])
+# A scope known to a DeviceRegistry, firmware_present is True if the custom firmware is running.
+RegisteredDevice = namedtuple('RegisteredDevice', ['port_path', 'address', 'vendor_id', 'product_id', 'bcd_device',
+                                                   'firmware_present', 'device'])
+
+
+class USBEventThread(object):
+    """
+    Handles the libusb events of a context on a dedicated thread. The thread sleeps in libusb until an event
+    arrives or the timeout expires, so no core is burnt on busy polling.
+    """
+    def __init__(self, context, timeout=0.1, tuning=None):
+        self.context = context
+        self.timeout = timeout
+        # keyword arguments of tune_current_thread applied by the thread, and what it actually applied
+        self.tuning = tuning
+        self.tuning_report = None
+        self.started = threading.Event()
+        self.running = False
+        self.thread = None
+
+
+    def start(self):
+        """
+        Start handling events, does nothing if the thread is already running.
+        :return: True if successful.
+        """
+        if self.thread is not None:
+            return True
+        self.running = True
+        self.started.clear()
+        self.thread = threading.Thread(target=self.run, name="libusb event handler", daemon=True)
+        self.thread.start()
+        # the tuning report is ready once the thread runs
+        self.started.wait()
+        return True
+
+
+    def run(self):
+        if self.tuning:
+            self.tuning_report = tune_current_thread(**self.tuning)
+        self.started.set()
+        handle_events = self.context.handleEventsTimeout
+        timeout = self.timeout
+        while self.running:
+            try:
+                handle_events(timeout)
+            except usb1.USBErrorInterrupted:
+                pass
+
+
+    def stop(self):
+        """
+        Stop handling events and wait until the thread has finished.
+        :return: True if successful.
+        """
+        if self.thread is None:
+            return True
+        self.running = False
+        try:
+            self.context.interruptEventHandler()
+        except AttributeError:
+            pass # older libusb1 versions, the thread ends after the timeout
+        self.thread.join()
+        self.thread = None
+        return True
+
+
+class AsyncioEventHandler(object):
+    """
+    Handles the libusb events of a context inside a running asyncio event loop. The libusb pollfds are registered
+    with the loop, so transfer completions are handled as soon as their file descriptor becomes ready, without
+    a polling thread or busy loop.
+    """
+    def __init__(self, context, loop):
+        self.context = context
+        self.loop = loop
+        self.readers = set()
+        self.writers = set()
+        self.timer = None
+
+
+    def start(self):
+        """
+        Register the pollfds of the context with the loop. Raises NotImplementedError on platforms without pollfds.
+        :return: True if successful.
+        """
+        for fd, events in self.context.getPollFDList():
+            self.added_fd(fd, events, self)
+        self.context.setPollFDNotifiers(self.added_fd, self.removed_fd, self)
+        self.schedule_timeout()
+        return True
+
+
+    def stop(self):
+        """
+        Unregister all pollfds from the loop.
+        :return: True if successful.
+        """
+        self.context.setPollFDNotifiers()
+        for fd in list(self.readers | self.writers):
+            self.removed_fd(fd, self)
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        return True
+
+
+    def added_fd(self, fd, events, user_data):
+        if events & select.POLLIN:
+            self.loop.add_reader(fd, self.handle_events)
+            self.readers.add(fd)
+        if events & select.POLLOUT:
+            self.loop.add_writer(fd, self.handle_events)
+            self.writers.add(fd)
+
+
+    def removed_fd(self, fd, user_data):
+        if fd in self.readers:
+            self.loop.remove_reader(fd)
+            self.readers.discard(fd)
+        if fd in self.writers:
+            self.loop.remove_writer(fd)
+            self.writers.discard(fd)
+
+
+    def handle_events(self):
+        self.context.handleEventsTimeout(0)
+        self.schedule_timeout()
+
+
+    def schedule_timeout(self):
+        # libusb without timerfd support needs to be called when its next internal timeout expires
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        timeout = self.context.getNextTimeout()
+        if timeout is not None:
+            self.timer = self.loop.call_later(timeout, self.handle_events)
+
+
+class BufferPool(object):
+    """
+    Preallocated transfer buffers, which are lent to the consumer and given back by release when done.
+    """
+    def __init__(self, buffer_size, count):
+        self.buffer_size = buffer_size
+        self.allocated = count
+        self.free = deque(bytearray(buffer_size) for _ in range(count))
+
+
+    def acquire(self):
+        """
+        Take a buffer out of the pool. If the consumer holds all of them, the pool grows by one buffer.
+        :return: A bytearray of buffer_size bytes.
+        """
+        try:
+            return self.free.popleft()
+        except IndexError:
+            self.allocated += 1
+            return bytearray(self.buffer_size)
+
+
+    def release(self, buffer):
+        """
+        Give a buffer back to the pool, it must not be used any more afterwards.
+        """
+        self.free.append(buffer)
+
+
+class AsyncReader(threading.Event):
+    """
+    Handle of a running read_async. Call stop() to cancel the transfers and wait until all of them are done, or
+    just set() to stop resubmitting them.
+    Exceptions raised by the consumer callback are counted in errors, the latest one is kept in last_exception.
+    """
+    def __init__(self, context, transfer_time=None, max_transfers=0, error_callback=None):
+        super(AsyncReader, self).__init__()
+        self.context = context
+        self.transfers = []
+        self.sequence = 0
+        self.sample_index = 0
+        self.transfer_time = transfer_time
+        self.max_transfers = max_transfers
+        self.last_completion = None
+        self.new_transfer = None
+        self.pool = None
+        self.error_callback = error_callback
+        self.errors = 0
+        self.last_exception = None
+        # the completion time of the block ending at sample_index, and the sample rate to extrapolate from there
+        self.sample_time = None
+        self.sample_rate = None
+        self.config_events = []
+        # recovers the true sample clock from the block completions, see SampleClock
+        self.clock = None
+        # held while checking for shutdown and submitting, so no transfer is submitted after stop() cancelled them
+        self.submit_lock = threading.Lock()
+
+
+    def consumer_failed(self, exception):
+        """
+        Count an exception raised by the consumer callback and pass it on to the error callback, if any.
+        The transfers keep running regardless.
+        """
+        self.errors += 1
+        self.last_exception = exception
+        if self.error_callback is not None:
+            try:
+                self.error_callback(exception)
+            except Exception:
+                pass
+
+
+    def stop(self, timeout=None):
+        """
+        Stop reading: cancel all transfers in flight and handle their completions until none is left.
+        Works whether the events are handled by poll(), the event thread or not at all.
+        :param timeout: (OPTIONAL) Maximum time to wait in seconds. Default: None (wait until done)
+        :return: True if all transfers are done, False if the timeout expired before.
+        """
+        with self.submit_lock:
+            self.set()
+        cancelled = set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            submitted = [transfer for transfer in self.transfers if transfer.isSubmitted()]
+            if not submitted:
+                return True
+            for transfer in submitted:
+                if transfer not in cancelled:
+                    cancelled.add(transfer)
+                    try:
+                        transfer.cancel()
+                    except usb1.USBErrorNotFound:
+                        pass # completed meanwhile
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+            if wait <= 0:
+                return False
+            # libusb serializes event handling, so this also works while an event thread is running
+            self.context.handleEventsTimeout(wait)
+
+
+    def submit(self, transfer, new=False):
+        """
+        Submit a transfer unless the reader is stopping.
+        :param transfer: The transfer to (re)submit.
+        :param new: (OPTIONAL) Add the transfer to the transfers of the reader. Default: False (resubmit)
+        :return: True if the transfer was submitted.
+        """
+        with self.submit_lock:
+            if self.is_set():
+                return False
+            transfer.submit()
+            if new:
+                self.transfers.append(transfer)
+            return True
+
+
+    def get_sample_index_at(self, timestamp):
+        """
+        Estimate the index of the sample taken at a time. The recovered sample clock is used once it has an
+        observation. Before that, the index is extrapolated from the latest completed block at the nominal rate. The
+        completion time of a block includes the transfer and completion latency, so that estimate is biased low by up
+        to one transfer.
+        :param timestamp: A time.monotonic() value.
+        :return: The estimated sample index.
+        """
+        if self.clock is not None and self.clock.reference_index is not None:
+            return max(0, int(self.clock.index_at(timestamp)))
+        if self.sample_time is None or not self.sample_rate:
+            return self.sample_index
+        return max(0, int(self.sample_index + (timestamp - self.sample_time) * self.sample_rate))
+
+
+    def record_config_change(self, setting, value, submitted, completed, settle_time=0.0):
+        """
+        Record a configuration change, which applies to the samples from its completion plus the settling time on.
+        :param setting: The name of the setting, e.g. 'ch1_voltage_range'.
+        :param value: The new value.
+        :param submitted: The time.monotonic() when the request was sent.
+        :param completed: The time.monotonic() when the request was done.
+        :param settle_time: (OPTIONAL) The time in seconds until the samples reflect the change. Default: 0
+        :return: The recorded ConfigEvent.
+        """
+        sample_index = self.get_sample_index_at(completed + settle_time)
+        for event in reversed(self.config_events):
+            if event.setting == setting:
+                # the requests are serialized, their effects must be in order as well
+                sample_index = max(sample_index, event.sample_index)
+                break
+        event = ConfigEvent(sample_index, min(sample_index, self.get_sample_index_at(submitted)), setting, value,
+                            submitted, completed)
+        self.config_events.append(event)
+        return event
+
+
+    def get_setting(self, setting, sample_index):
+        """
+        :return: The value of the setting in effect for the sample, or None if it is unknown.
+        """
+        for event in reversed(self.config_events):
+            if event.setting == setting and event.sample_index <= sample_index:
+                return event.value
+        return None
+
+
+    def get_segments(self, setting, sample_index, count):
+        """
+        Split a range of samples where the setting changes.
+        :param setting: The name of the setting.
+        :param sample_index: The index of the first sample, e.g. BlockInfo.sample_index.
+        :param count: The number of samples.
+        :return: A list of (start, end, value) tuples, start and end relative to sample_index.
+        """
+        changes = [event for event in self.config_events
+                   if event.setting == setting and sample_index < event.sample_index < sample_index + count]
+        segments = []
+        start, value = 0, self.get_setting(setting, sample_index)
+        for event in changes:
+            segments.append((start, event.sample_index - sample_index, value))
+            start, value = event.sample_index - sample_index, event.value
+        segments.append((start, count, value))
+        return segments
+
+
+    def track_completion(self, timestamp):
+        """
+        Submit another transfer if the time since the last completion shows that the queue of outstanding
+        transfers was about to run dry.
+        """
+        if self.last_completion is not None:
+            queued_time = len(self.transfers) * self.transfer_time
+            if (timestamp - self.last_completion > queued_time / 2 and len(self.transfers) < self.max_transfers
+                    and not self.is_set()):
+                self.new_transfer()
+        self.last_completion = timestamp
+
+
+class ControlQueue(object):
+    """
+    Serializes vendor control requests and sends them as asynchronous control transfers, one at a time in the order
+    they were submitted. Requests can be submitted from any thread, the caller gets a concurrent.futures.Future.
+    The requests complete while the libusb events are handled (event thread, poll() or a stream).
+    """
+    def __init__(self, context, device_handle):
+        self.context = context
+        self.transfer = device_handle.getTransfer()
+        self.pending = deque()
+        self.current = None
+        self.lock = threading.Lock()
+
+
+    def submit(self, request, value, index, data, timeout=0, on_done=None):
+        """
+        Queue a vendor control write.
+        :param on_done: (OPTIONAL) Called with the number of bytes written when the transfer completes, its return
+                        value becomes the result of the future. Default: None (the number of bytes written)
+        :return: A Future for the result.
+        """
+        future = Future()
+        with self.lock:
+            self.pending.append((request, value, index, data, timeout, on_done, future))
+            if self.current is None:
+                self.submit_next()
+        return future
+
+
+    def submit_next(self):
+        """
+        Internal function submitting the next pending request, called with the lock held.
+        """
+        self.current = None
+        while self.pending:
+            request, value, index, data, timeout, on_done, future = self.pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            # the completion may arrive before submit returns
+            self.current = (on_done, future)
+            try:
+                self.transfer.setControl(0x40, request, value, index, data, callback=self.transfer_callback,
+                                         timeout=timeout)
+                self.transfer.submit()
+            except usb1.USBError as exception:
+                self.current = None
+                future.set_exception(exception)
+                continue
+            return
+
+
+    def transfer_callback(self, transfer):
+        with self.lock:
+            on_done, future = self.current
+        status = transfer.getStatus()
+        if status == libusb1.LIBUSB_TRANSFER_COMPLETED:
+            try:
+                length = transfer.getActualLength()
+                future.set_result(on_done(length) if on_done else length)
+            except Exception as exception:
+                future.set_exception(exception)
+        else:
+            future.set_exception(usb1.USBError("control transfer failed with status {}".format(status)))
+        with self.lock:
+            self.submit_next()
+
+
+    def close(self, timeout=1):
+        """
+        Cancel the pending requests and the transfer in flight, and wait until it is done.
+        :param timeout: (OPTIONAL) Maximum time to wait in seconds. Default: 1 s
+        :return: True if the transfer is done, False if the timeout expired before.
+        """
+        with self.lock:
+            for request in self.pending:
+                request[-1].cancel()
+            self.pending.clear()
+        if self.transfer.isSubmitted():
+            try:
+                self.transfer.cancel()
+            except usb1.USBErrorNotFound:
+                pass # completed meanwhile
+        deadline = time.monotonic() + timeout
+        while self.transfer.isSubmitted():
+            if time.monotonic() >= deadline:
+                return False
+            self.context.handleEventsTimeout(0.1)
+        return True
+
+
+class DeviceRegistry(object):
+    """
+    The scopes attached to a context, classified by port path and firmware state. The bus is enumerated once, and
+    the view is kept current by libusb hotplug events where available (otherwise update() rescans in one pass).
+    Scopes opened by an Oscilloscope are claimed, so several instances sharing a registry each get a free one.
+    """
+    def __init__(self, context, extra_ids=()):
+        """
+        :param context: The usb1.USBContext.
+        :param extra_ids: (OPTIONAL) Further (VID, PID) pairs to track, e.g. of a user defined scope. Default: none
+        """
+        self.context = context
+        self.extra_ids = set(extra_ids)
+        self.entries = {}
+        # port path -> weak reference to the claiming owner
+        self.claims = {}
+        self.lock = threading.Lock()
+        self.hotplug_handle = None
+        self.started = False
+
+
+    def is_tracked(self, vendor_id, product_id):
+        return ( (vendor_id, product_id) in self.extra_ids
+              or ( vendor_id in (Oscilloscope.NO_FIRMWARE_VENDOR_ID, Oscilloscope.FIRMWARE_PRESENT_VENDOR_ID)
+               and product_id in (Oscilloscope.PRODUCT_ID_BE, Oscilloscope.PRODUCT_ID_BL) ) )
+
+
+    def make_entry(self, device):
+        vendor_id, bcd_device = device.getVendorID(), device.getbcdDevice()
+        return RegisteredDevice((device.getBusNumber(),) + tuple(device.getPortNumberList()),
+                                device.getDeviceAddress(), vendor_id, device.getProductID(), bcd_device,
+                                vendor_id == Oscilloscope.FIRMWARE_PRESENT_VENDOR_ID
+                                and bcd_device == Oscilloscope.FIRMWARE_VERSION, device)
+
+
+    def start(self):
+        """
+        Enumerate the bus, and follow the hotplug events if libusb supports them. Does nothing if already started.
+        :return: True if successful.
+        """
+        if self.started:
+            return True
+        self.started = True
+        if usb1.hasCapability(usb1.CAP_HAS_HOTPLUG):
+            # the devices already attached are reported on registration
+            self.hotplug_handle = self.context.hotplugRegisterCallback(self.hotplug_callback)
+        else:
+            self.refresh()
+        return True
+
+
+    def hotplug_callback(self, context, device, event):
+        if not self.is_tracked(device.getVendorID(), device.getProductID()):
+            return False
+        entry = self.make_entry(device)
+        with self.lock:
+            if event == usb1.HOTPLUG_EVENT_DEVICE_ARRIVED:
+                self.entries[entry.port_path] = entry
+            elif entry.port_path in self.entries and self.entries[entry.port_path].address == entry.address:
+                # a late departure must not remove the device that reenumerated on the same port
+                del self.entries[entry.port_path]
+        return False
+
+
+    def refresh(self):
+        """
+        Rebuild the view with a single pass over the bus.
+        :return: None
+        """
+        entries = {}
+        for device in self.context.getDeviceIterator(skip_on_error=True):
+            if self.is_tracked(device.getVendorID(), device.getProductID()):
+                entry = self.make_entry(device)
+                entries[entry.port_path] = entry
+        with self.lock:
+            self.entries = entries
+
+
+    def update(self):
+        """
+        Bring the view up to date: handle the pending hotplug events without blocking, or rescan without hotplug.
+        :return: None
+        """
+        if not self.started:
+            self.start()
+        elif self.hotplug_handle is not None:
+            self.context.handleEventsTimeout(0)
+        else:
+            self.refresh()
+
+
+    def get(self, port_path):
+        """
+        :param port_path: The port path, see Oscilloscope.get_port_path.
+        :return: The RegisteredDevice at this port, or None.
+        """
+        return self.entries.get(tuple(port_path))
+
+
+    def get_all(self):
+        """
+        :return: All RegisteredDevice entries, sorted by port path.
+        """
+        with self.lock:
+            return sorted(self.entries.values(), key=lambda entry: entry.port_path)
+
+
+    def is_claimed(self, port_path, owner=None):
+        """
+        :return: True if the scope at the port path is claimed by a live owner other than the given one.
+        """
+        claim = self.claims.get(tuple(port_path))
+        claimant = claim() if claim else None
+        return claimant is not None and claimant is not owner
+
+
+    def find(self, vendor_id, product_id, owner=None):
+        """
+        Find the next free scope with these IDs.
+        :param owner: (OPTIONAL) Scopes claimed by this owner count as free. Default: None
+        :return: The RegisteredDevice with the lowest port path, or None.
+        """
+        for entry in self.get_all():
+            if (entry.vendor_id, entry.product_id) == (vendor_id, product_id) \
+                    and not self.is_claimed(entry.port_path, owner):
+                return entry
+        return None
+
+
+    def claim(self, port_path, owner):
+        """
+        Mark the scope at the port path as used by the owner, until it is released or the owner is gone.
+        :return: True if successful, False if another owner holds the claim.
+        """
+        with self.lock:
+            if self.is_claimed(port_path, owner):
+                return False
+            self.claims[tuple(port_path)] = weakref.ref(owner)
+            return True
+
+
+    def release(self, port_path, owner):
+        """
+        Drop the owner's claim on the scope at the port path.
+        :return: True if successful.
+        """
+        with self.lock:
+            if not self.is_claimed(port_path, owner):
+                self.claims.pop(tuple(port_path), None)
+            return True
+
+
+    def close(self):
+        """
+        Stop following the hotplug events.
+        :return: True if successful.
+        """
+        if self.hotplug_handle is not None:
+            self.context.hotplugDeregisterCallback(self.hotplug_handle)
+            self.hotplug_handle = None
+        self.started = False
+        return True
+
 
 class Oscilloscope(object):
     FIRMWARE_VERSION = 0x0206
@@ -63,6 +678,17 @@ class Oscilloscope(object):
     CALIBRATION_EEPROM_SIZE     = 32
     CALIBRATION_EEPROM_EXT_SIZE = 80
 
+    # The bulk endpoint FIFO is quad buffered with 512 bytes each. While nobody reads, it holds stale samples.
+    FIFO_SIZE = 4 * 512
+    # Time for the ADC and GPIF to deliver valid samples after the start of a capture.
+    SETTLE_TIME = 100e-6
+
+    # Time until the samples reflect a configuration change, used to tag the changes in a running read_async.
+    CONFIG_SETTLE_TIMES = {'sample_rate': 0.0, 'ch1_voltage_range': 1e-3, 'ch2_voltage_range': 1e-3, 'ac_dc': 1e-3}
+
+    # High speed allows at most 13 bulk packets of 512 bytes per 125 us microframe, shared with all other devices.
+    MAX_BULK_BANDWIDTH = 13 * 512 * 8000
+
 
     SAMPLE_RATES = {
                     102: ( "20 kS/s",  20e3),
@@ -110,16 +736,27 @@ class Oscilloscope(object):
 
 
     # defaults to 6022BE with the possibility to supply a non standard VID/PID combination
-    def __init__(self, VID=NO_FIRMWARE_VENDOR_ID, PID=PRODUCT_ID_BE):
+    # several scopes can share a context, and a device (from that context) binds the instance to its USB port
+    # scopes sharing a DeviceRegistry find their devices without scanning the bus
+    def __init__(self, VID=NO_FIRMWARE_VENDOR_ID, PID=PRODUCT_ID_BE, context=None, device=None, registry=None):
         self.device = None
         self.device_handle = None
-        self.context = usb1.USBContext()
+        self.context = context or usb1.USBContext()
+        self.registry = registry
+        self.port_path = self.get_port_path(device) if device else None
         self.is_device_firmware_present = False
         self.supports_single_channel = False
         self.is_iso = False
         self.packetsize = None
+        self.interface_alt = 0
         self.num_channels = 2
+        self.sample_rate_index = 1 # the custom firmware starts with 1 MS/s
+        self.armed = False
+        # whether the device was last told to capture
+        self.capturing = False
         self.ac_dc_status = 0x11
+        self.ch1_voltage_range = None
+        self.ch2_voltage_range = None
         self.VID=VID
         self.PID=PID
         self.calibration = None
@@ -128,58 +765,150 @@ class Oscilloscope(object):
         self.offset2 = { 1:0, 2:0, 5:0, 10:0 }
         self.gain1 = { 1:1.01, 2:1.01, 5:0.99, 10:1.0 }
         self.gain2 = { 1:1.01, 2:1.01, 5:0.99, 10:1.0 }
+        self.event_thread = USBEventThread(self.context)
+        self.dropped_blocks = 0
+        self.bytes_received = 0
+        self.packets_in_error = 0
+        self.samples_lost = 0
+        self.async_readers = []
+        self.control_queue = None
+        # the libusb events are handled by an asyncio loop while an astream or aset_* call runs
+        self.asyncio_event_handler = None
+        self.asyncio_event_users = 0
+
+
+    def get_port_path(self, device):
+        """
+        The location of a device, which unlike its address is kept when the device reenumerates after flashing.
+        :param device: The usb1.USBDevice.
+        :return: A tuple of the bus number and the port numbers from the root hub.
+        """
+        return (device.getBusNumber(),) + tuple(device.getPortNumberList())
+
+
+    def is_supported_device(self, device):
+        """
+        Check whether a device is a 6022{BE,BL} (with or without firmware) or the user defined scope.
+        :param device: The usb1.USBDevice.
+        :return: True if the device can be driven by this instance.
+        """
+        if (device.getVendorID(), device.getProductID()) == (self.VID, self.PID):
+            return True
+        return ( device.getVendorID() in (self.NO_FIRMWARE_VENDOR_ID, self.FIRMWARE_PRESENT_VENDOR_ID)
+             and device.getProductID() in (self.PRODUCT_ID_BE, self.PRODUCT_ID_BL) )
+
+
+    def bind_device(self, device):
+        """
+        Use a device found on the bus and derive its firmware state.
+        :param device: The usb1.USBDevice, see is_supported_device.
+        :return: True
+        """
+        self.device = device
+        self.supports_single_channel = \
+        self.is_device_firmware_present = (
+              self.device.getVendorID() == self.FIRMWARE_PRESENT_VENDOR_ID
+          and self.device.getbcdDevice() == self.FIRMWARE_VERSION
+        ) # latest custom FW loaded
+        return True
+
+
+    def wait_for_device(self, port_path=None, old_address=None, timeout=10, poll_interval=0.05):
+        """
+        Wait until a scope running firmware shows up, e.g. after flashing, and bind it to this instance. libusb
+        hotplug events are used where available, so this returns as soon as the device has enumerated; otherwise
+        the bus is polled.
+        :param port_path: (OPTIONAL) Only accept a scope at this port path. Default: None (any port)
+        :param old_address: (OPTIONAL) Ignore the device with this bus address, i.e. the one that was flashed and
+                            has not disconnected yet. Default: None
+        :param timeout: (OPTIONAL) The time to wait in seconds. Default: 10 seconds
+        :param poll_interval: (OPTIONAL) The polling interval without hotplug support. Default: 50 ms
+        :return: True if a scope was found, False on timeout.
+        """
+        def is_ready(device):
+            return ( self.is_supported_device(device)
+                 and device.getVendorID() != self.NO_FIRMWARE_VENDOR_ID
+                 and (port_path is None or self.get_port_path(device) == port_path)
+                 and device.getDeviceAddress() != old_address )
+
+        deadline = time.monotonic() + timeout
+        if usb1.hasCapability(usb1.CAP_HAS_HOTPLUG):
+            arrived = []
+            def hotplug_callback(context, device, event):
+                if not arrived and is_ready(device):
+                    arrived.append(device)
+                # libusb ignores the return value for the devices reported on registration, so the callback is
+                # always deregistered explicitly
+                return False
+            # the devices already attached are reported on registration, so an early arrival is not missed
+            handle = self.context.hotplugRegisterCallback(hotplug_callback, events=usb1.HOTPLUG_EVENT_DEVICE_ARRIVED)
+            try:
+                while not arrived:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    # safe alongside a running event thread, libusb serializes the event handling
+                    self.context.handleEventsTimeout(min(remaining, 0.1))
+            finally:
+                try:
+                    self.context.hotplugDeregisterCallback(handle)
+                except KeyError:
+                    pass # already deregistered
+            return self.bind_device(arrived[0])
+
+        while True:
+            for device in self.context.getDeviceIterator(skip_on_error=True):
+                if is_ready(device):
+                    return self.bind_device(device)
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_interval)
+
+
+    def get_registry(self):
+        """
+        :return: The DeviceRegistry of this instance, a private one is created on first use.
+        """
+        if self.registry is None:
+            self.registry = DeviceRegistry(self.context, [(self.VID, self.PID)])
+        elif not self.registry.is_tracked(self.VID, self.PID):
+            # a shared registry learns about a user defined scope
+            self.registry.extra_ids.add((self.VID, self.PID))
+            if self.registry.started:
+                self.registry.refresh()
+        return self.registry
 
 
     def setup(self):
         """
-        Attempt to find a suitable scope to run.
+        Attempt to find a suitable scope to run. If the instance was created for a device, only the scope on the
+        same port is used. Scopes claimed by other instances sharing the registry are skipped.
         :return: True if a 6022{BE,BL} (or user defined) scope was found, False otherwise.
         """
+        registry = self.get_registry()
+        registry.update()
+        self.device = None
+        if self.port_path:
+            entry = registry.get(self.port_path)
+            if not entry or not self.is_supported_device(entry.device):
+                return False
+            return self.bind_device(entry.device)
+
         # look for a user defined device that doesn't match 6022{BE,BL}
         if ( ( self.VID != self.NO_FIRMWARE_VENDOR_ID and self.VID != self.FIRMWARE_PRESENT_VENDOR_ID )
         or ( self.PID != self.PRODUCT_ID_BE and self.PID != self.PRODUCT_ID_BL ) ):
-            self.device = (
-                self.context.getByVendorIDAndProductID(
-                    self.VID, self.PID, skip_on_error=True, skip_on_access_error=True
-                )
-            )
-            if self.device:
+            entry = registry.find(self.VID, self.PID, owner=self)
+            if entry:
+                self.device = entry.device
                 self.is_device_firmware_present = False
                 return True
 
-        # 1st look for 6022BE
-        self.device = (
-            self.context.getByVendorIDAndProductID(
-                self.FIRMWARE_PRESENT_VENDOR_ID, self.PRODUCT_ID_BE, skip_on_error=True, skip_on_access_error=True
-            )
-         or self.context.getByVendorIDAndProductID(
-                self.NO_FIRMWARE_VENDOR_ID, self.PRODUCT_ID_BE, skip_on_error=True, skip_on_access_error=True
-            )
-        )
-        if self.device:
-            self.supports_single_channel = \
-            self.is_device_firmware_present = (
-                  self.device.getVendorID() == self.FIRMWARE_PRESENT_VENDOR_ID
-              and self.device.getbcdDevice() == self.FIRMWARE_VERSION
-            ) # latest custom FW loaded
-            return True
-
-        # if not found look for 6022BL
-        self.device = (
-            self.context.getByVendorIDAndProductID(
-                self.FIRMWARE_PRESENT_VENDOR_ID, self.PRODUCT_ID_BL, skip_on_error=True, skip_on_access_error=True
-            )
-         or self.context.getByVendorIDAndProductID(
-                self.NO_FIRMWARE_VENDOR_ID, self.PRODUCT_ID_BL, skip_on_error=True, skip_on_access_error=True
-            )
-        )
-        if self.device:
-            self.supports_single_channel = \
-            self.is_device_firmware_present = (
-                  self.device.getVendorID() == self.FIRMWARE_PRESENT_VENDOR_ID
-              and self.device.getbcdDevice() == self.FIRMWARE_VERSION
-            ) # latest custom FW loaded
-            return True
+        # 1st look for 6022BE, if not found look for 6022BL, scopes with firmware first
+        for product_id in (self.PRODUCT_ID_BE, self.PRODUCT_ID_BL):
+            for vendor_id in (self.FIRMWARE_PRESENT_VENDOR_ID, self.NO_FIRMWARE_VENDOR_ID):
+                entry = registry.find(vendor_id, product_id, owner=self)
+                if entry:
+                    return self.bind_device(entry.device)
 
         return False
 
@@ -194,6 +923,7 @@ class Oscilloscope(object):
         if not self.device and not self.setup():
             return False
         self.device_handle = self.device.open()
+        self.get_registry().claim(self.get_port_path(self.device), self)
         if os.name == 'posix' and self.device_handle.kernelDriverActive(0):
             self.device_handle.detachKernelDriver(0)
         self.device_handle.claimInterface(0)
@@ -211,10 +941,21 @@ class Oscilloscope(object):
         """
         if not self.device_handle:
             return True
+        # no completion must arrive after the handle is gone
+        for reader in self.async_readers:
+            reader.stop(timeout=1)
+        self.async_readers = []
+        if self.control_queue:
+            self.control_queue.close()
+            self.control_queue = None
+        if self.armed:
+            self.disarm()
         if release_interface:
             self.device_handle.releaseInterface(0)
         self.device_handle.close()
         self.device_handle = None
+        if self.registry is not None and self.device is not None:
+            self.registry.release(self.get_port_path(self.device), self)
         return True
 
 
@@ -236,14 +977,54 @@ class Oscilloscope(object):
         self.context.handleEvents()
 
 
-    def flash_firmware(self, firmware=None, supports_single_channel=True, timeout=60):
+    def start_event_thread(self, cpus=None, priority=None, policy='fifo'):
+        """
+        Handle the libusb events on a dedicated thread, so there is no need to call poll() any more.
+        The thread can be tuned for acquisition, whatever is not supported or permitted is skipped. What was
+        actually applied is reported in event_thread.tuning_report, see PyHT6022.Realtime.tune_current_thread.
+        :param cpus: (OPTIONAL) The CPUs to pin the thread to. Default: None (leave it)
+        :param priority: (OPTIONAL) The SCHED_FIFO/SCHED_RR priority, 1 to 99. Default: None (normal scheduling)
+        :param policy: (OPTIONAL) 'fifo' or 'rr'. Default: 'fifo'
+        :return: True if successful.
+        """
+        if cpus is not None or priority is not None:
+            self.event_thread.tuning = {'cpus': cpus, 'priority': priority, 'policy': policy}
+        return self.event_thread.start()
+
+
+    def lock_reader_memory(self, reader, *buffers):
+        """
+        Lock the transfer buffers of an async reader into RAM, so the acquisition path never page faults.
+        :param reader: The AsyncReader returned by read_async.
+        :param buffers: Further buffers to lock, e.g. the buffer of a RingBuffer.
+        :return: The number of bytes locked and the number of bytes that could not be locked (e.g. because of
+                 RLIMIT_MEMLOCK).
+        """
+        transfer_buffers = [transfer.getBuffer() for transfer in reader.transfers]
+        pool_buffers = list(reader.pool.free) if reader.pool else []
+        return lock_memory(*(transfer_buffers + pool_buffers + list(buffers)))
+
+
+    def stop_event_thread(self):
+        """
+        Stop the dedicated event thread started by start_event_thread.
+        :return: True if successful.
+        """
+        return self.event_thread.stop()
+
+
+    def flash_firmware(self, firmware=None, supports_single_channel=True, timeout=60, coalesce=True, verify=False):
         """
         Flash scope firmware to the target scope device. This needs to occur once when the device is first attached,
         as the 6022BE does not have any persistant storage.
         :param firmware: (OPTIONAL) The firmware packets to send. Default: custom firmware (either BE or BL).
         :param supports_single_channel: (OPTIONAL) Set this to false if loading the stock firmware, as it does not
                                         support reducing the number of active channels.
-        :param timeout: (OPTIONAL) A timeout for each packet transfer on the firmware upload. Default: 60 seconds.
+        :param timeout: (OPTIONAL) A timeout for each packet transfer on the firmware upload, and for the scope to
+                        come back with the firmware. Default: 60 seconds.
+        :param coalesce: (OPTIONAL) Merge contiguous packets into control writes of up to 4 KiB. Default: On
+        :param verify: (OPTIONAL) Read the written memory back and compare it before the 8051 is started.
+                       Asserts on a mismatch. Default: Off
         :return: True if the correct device vendor was found after flashing firmware, False if the default Vendor ID
                  was present for the device. May assert or raise various libusb errors if something went wrong.
         """
@@ -251,26 +1032,52 @@ class Oscilloscope(object):
             assert self.open_handle()
         if not firmware: # called without an explicit firmware parameter
             if self.device.getProductID() == self.PRODUCT_ID_BE:
-                firmware = custom_firmware_BE
+                firmware = HantekFirmware.custom_firmware_BE
             elif self.device.getProductID() == self.PRODUCT_ID_BL:
-                firmware = custom_firmware_BL
+                firmware = HantekFirmware.custom_firmware_BL
             else:
                 return False
+        if coalesce:
+            firmware = HantekFirmware.coalesce_control_packets(firmware)
         for packet in firmware:
+            if verify and packet.value == HantekFirmware.CPUCS_ADDRESS and packet.data == b'\x00':
+                # the 8051 is still held in reset, so the memory is exactly what was written
+                self.verify_firmware(firmware, timeout)
             bytes_written = self.device_handle.controlWrite(0x40, self.RW_FIRMWARE_REQUEST,
                                                             packet.value, self.RW_FIRMWARE_INDEX,
                                                             packet.data, timeout=timeout)
             assert bytes_written == packet.size
-        # After firmware is written, scope will typically show up again as a different device, so scan again
+        # After firmware is written, scope will typically show up again as a different device on the same port
+        port_path, old_address = self.get_port_path(self.device), self.device.getDeviceAddress()
         self.close_handle(release_interface=False)
-        time.sleep(.5)
-        while not self.setup():
-            time.sleep(0.1)
+        self.device = None
+        if not self.wait_for_device(port_path, old_address, timeout=timeout):
+            return False
         self.supports_single_channel = supports_single_channel
         self.open_handle()
         return self.is_device_firmware_present
 
 
+    def verify_firmware(self, firmware, timeout=60, chunk_len=HantekFirmware.MAX_CONTROL_SIZE):
+        """
+        Compare the device memory with the firmware packets, while the 8051 is held in reset.
+        :param firmware: The firmware packets written.
+        :param timeout: (OPTIONAL) A timeout for each transfer. Default: 60 seconds.
+        :param chunk_len: (OPTIONAL) The largest control read. Default: 4 KiB
+        :return: True if the memory matches. Asserts on a mismatch.
+        """
+        for packet in firmware:
+            if packet.value == HantekFirmware.CPUCS_ADDRESS:
+                continue
+            for offset in range(0, packet.size, chunk_len):
+                expected = packet.data[offset:offset + chunk_len]
+                chunk = self.device_handle.controlRead(0x40, self.RW_FIRMWARE_REQUEST,
+                                                       packet.value + offset, self.RW_FIRMWARE_INDEX,
+                                                       len(expected), timeout=timeout)
+                assert chunk == expected, "firmware verify failed at 0x{:04x}".format(packet.value + offset)
+        return True
+
+
     def flash_firmware_from_hex(self, hex_file, timeout=60):
         """
         Open an Intel hex file for the 8051 and try to flash it to the scope.
@@ -279,17 +1086,21 @@ class Oscilloscope(object):
         :return: True if the correct device vendor was found after flashing firmware, False if the default Vendor ID
                  was present for the device. May assert or raise various libusb errors if something went wrong.
         """
-        return self.flash_firmware(firmware=fx2_ihex_to_control_packets(hex_file), timeout=timeout)
+        return self.flash_firmware(firmware=HantekFirmware.fx2_ihex_to_control_packets(hex_file), timeout=timeout)
 
 
-    def read_firmware(self, address=0, length=8192, to_ihex=True, chunk_len=16, timeout=60):
+    def read_firmware(self, address=0, length=8192, to_ihex=True, chunk_len=HantekFirmware.MAX_CONTROL_SIZE,
+                      timeout=60, record_len=16, output=None):
         """
         Read the entire device RAM, and return a raw string.
         :param to_ihex: (OPTIONAL) Convert the firmware into the Intel hex format after reading. Otherwise, return
                         the firmware is a raw byte string. Default: True
-        :param chunk_len: (OPTIONAL) The length of RAM chunks to pull from the device at a time. Default: 16 bytes.
+        :param chunk_len: (OPTIONAL) The length of RAM chunks to pull from the device at a time. Default: 4 KiB.
         :param timeout: (OPTIONAL) A timeout for each packet transfer on the firmware upload. Default: 60 seconds.
-        :return: The raw device firmware, if successful.
+        :param record_len: (OPTIONAL) The number of data bytes per Intel hex record. Default: 16 bytes.
+        :param output: (OPTIONAL) A file object to write the firmware to instead of returning it, opened in text
+                       mode for Intel hex and in binary mode for raw. Default: None
+        :return: The raw device firmware, or True if it was written to output, if successful.
                  May assert or raise various libusb errors if something went wrong.
         """
         if not self.device_handle:
@@ -300,36 +1111,33 @@ class Oscilloscope(object):
                                                         b'\x01', timeout=timeout)
         assert bytes_written == 1
         firmware_chunk_list = []
-        # TODO: Fix this for when 8192 isn't divisible by chunk_len
-        for packet in range(0, length//chunk_len):
-            chunk = self.device_handle.controlRead(0x40, self.RW_FIRMWARE_REQUEST,
-                                                   address + packet * chunk_len, self.RW_FIRMWARE_INDEX,
-                                                   chunk_len, timeout=timeout)
-            firmware_chunk_list.append(chunk)
-            assert len(chunk) == chunk_len
-        bytes_written = self.device_handle.controlWrite(0x40, self.RW_FIRMWARE_REQUEST,
-                                                        0xe600, self.RW_FIRMWARE_INDEX,
-                                                        b'\x00', timeout=timeout)
+        try:
+            for offset in range(0, length, chunk_len):
+                size = min(chunk_len, length - offset)
+                chunk = self.device_handle.controlRead(0x40, self.RW_FIRMWARE_REQUEST,
+                                                       address + offset, self.RW_FIRMWARE_INDEX,
+                                                       size, timeout=timeout)
+                firmware_chunk_list.append(chunk)
+                assert len(chunk) == size
+        finally:
+            # never leave the 8051 halted
+            bytes_written = self.device_handle.controlWrite(0x40, self.RW_FIRMWARE_REQUEST,
+                                                            0xe600, self.RW_FIRMWARE_INDEX,
+                                                            b'\x00', timeout=timeout)
         assert bytes_written == 1
-        if not to_ihex:
-            return ''.join(firmware_chunk_list)
-        else:
-            lines = []
-            for i, chunk in enumerate(firmware_chunk_list):
-                addr = address + i*chunk_len
-                iterable_chunk = array.array('B', chunk)
-                hex_data = "".join(["{:02x}".format(b) for b in iterable_chunk])
-                total_sum = (sum(iterable_chunk) + chunk_len + (addr % 256) + (addr >> 8)) % 256
-                checksum = (((0xFF ^ total_sum) & 0xFF) + 0x01) % 256
-                line = ":{nbytes:02x}{addr:04x}{itype:02x}{hex_data}{checksum:02x}".format(nbytes=chunk_len,
-                                                                                           addr=addr,
-                                                                                           itype=0x00,
-                                                                                           hex_data=hex_data,
-                                                                                           checksum=checksum)
-                lines.append(line)
+        firmware = b''.join(firmware_chunk_list)
+        if to_ihex:
+            lines = HantekFirmware.binary_to_ihex_records(firmware, address, record_len)
             # Add stop record at the end.
-            lines.append(":00000001ff")
-            return "\n".join(lines)
+            lines.append(HantekFirmware.IHEX_END_RECORD)
+            if output is None:
+                return "\n".join(lines)
+            output.writelines(line + "\n" for line in lines)
+        elif output is None:
+            return firmware
+        else:
+            output.write(firmware)
+        return True
 
 
     def get_calibration_values(self, size=32, timeout=0):
@@ -454,6 +1262,7 @@ class Oscilloscope(object):
         bytes_written = self.device_handle.controlWrite(0x40, self.TRIGGER_REQUEST,
                                                         self.TRIGGER_VALUE, self.TRIGGER_INDEX,
                                                         b'\x01', timeout=timeout)
+        self.capturing = bytes_written == 1
         return bytes_written == 1
 
 
@@ -467,18 +1276,205 @@ class Oscilloscope(object):
         bytes_written = self.device_handle.controlWrite(0x40, self.TRIGGER_REQUEST,
                                                         self.TRIGGER_VALUE, self.TRIGGER_INDEX,
                                                         b'\x00', timeout=timeout)
+        if bytes_written == 1:
+            self.capturing = False
         return bytes_written == 1
 
 
-    def read_data(self, data_size=0x400, raw=False, timeout=0):
+    def record_config_change(self, setting, value, submitted):
+        """
+        Tag a completed configuration change in all running async readers, see AsyncReader.config_events.
+        :param setting: The name of the setting, one of the keys of CONFIG_SETTLE_TIMES.
+        :param value: The new value.
+        :param submitted: The time.monotonic() when the request was sent.
+        :return: None
+        """
+        completed = time.monotonic()
+        for reader in self.async_readers:
+            if not reader.is_set():
+                event = reader.record_config_change(setting, value, submitted, completed,
+                                                    self.CONFIG_SETTLE_TIMES[setting])
+                if setting == 'sample_rate':
+                    sample_rate = self.SAMPLE_RATES.get(value, (None, None))[1]
+                    if reader.transfer_time and not self.is_iso and reader.sample_rate and sample_rate:
+                        # the bulk transfers keep their size, so they take longer or shorter to fill
+                        reader.transfer_time *= reader.sample_rate / sample_rate
+                    reader.sample_rate = sample_rate
+                    # the clock model starts over at the new rate
+                    if reader.clock and reader.sample_rate:
+                        reader.clock.reset(reader.sample_rate, event.sample_index, completed)
+
+
+    def submit_control(self, request, value, index, data, timeout=0, on_done=None):
+        """
+        Queue a vendor control write without blocking: the requests are sent as asynchronous control transfers, one
+        after the other, so reconfiguring from any thread never stalls the sample path. The requests complete while
+        the libusb events are handled, e.g. by the event thread, poll() or a running stream.
+        :param timeout: (OPTIONAL) A timeout for the transfer. Default: 0 (No timeout)
+        :param on_done: (OPTIONAL) Called with the number of bytes written on completion, its return value becomes
+                        the result of the future. Default: None (the number of bytes written)
+        :return: A concurrent.futures.Future for the result, use asyncio.wrap_future to await it.
+        """
+        if not self.device_handle:
+            assert self.open_handle()
+        if not self.control_queue:
+            self.control_queue = ControlQueue(self.context, self.device_handle)
+        return self.control_queue.submit(request, value, index, data, timeout, on_done)
+
+
+    def submit_start_capture(self, timeout=0):
+        """
+        Non-blocking variant of start_capture, see submit_control.
+        :return: A Future for True if successful.
+        """
+        def on_done(length):
+            self.capturing = length == 1
+            return length == 1
+        return self.submit_control(self.TRIGGER_REQUEST, self.TRIGGER_VALUE, self.TRIGGER_INDEX, b'\x01', timeout,
+                                   on_done)
+
+
+    def submit_stop_capture(self, timeout=0):
+        """
+        Non-blocking variant of stop_capture, see submit_control.
+        :return: A Future for True if successful.
+        """
+        def on_done(length):
+            if length == 1:
+                self.capturing = False
+            return length == 1
+        return self.submit_control(self.TRIGGER_REQUEST, self.TRIGGER_VALUE, self.TRIGGER_INDEX, b'\x00', timeout,
+                                   on_done)
+
+
+    def submit_sample_rate(self, rate_index, timeout=0):
+        """
+        Non-blocking variant of set_sample_rate, see submit_control. sample_rate_index is updated on completion.
+        :return: A Future for True if successful.
+        """
+        submitted = time.monotonic()
+        def on_done(length):
+            assert length == 0x01
+            self.sample_rate_index = rate_index
+            self.record_config_change('sample_rate', rate_index, submitted)
+            return True
+        return self.submit_control(self.SET_SAMPLE_RATE_REQUEST, self.SET_SAMPLE_RATE_VALUE,
+                                   self.SET_SAMPLE_RATE_INDEX, pack("B", rate_index), timeout, on_done)
+
+
+    def submit_ch1_voltage_range(self, range_index, timeout=0):
+        """
+        Non-blocking variant of set_ch1_voltage_range, see submit_control.
+        :return: A Future for True if successful.
+        """
+        submitted = time.monotonic()
+        def on_done(length):
+            assert length == 0x01
+            self.ch1_voltage_range = range_index
+            self.record_config_change('ch1_voltage_range', range_index, submitted)
+            return True
+        return self.submit_control(self.SET_CH1_VR_REQUEST, self.SET_CH1_VR_VALUE, self.SET_CH1_VR_INDEX,
+                                   pack("B", range_index), timeout, on_done)
+
+
+    def submit_ch2_voltage_range(self, range_index, timeout=0):
+        """
+        Non-blocking variant of set_ch2_voltage_range, see submit_control.
+        :return: A Future for True if successful.
+        """
+        submitted = time.monotonic()
+        def on_done(length):
+            assert length == 0x01
+            self.ch2_voltage_range = range_index
+            self.record_config_change('ch2_voltage_range', range_index, submitted)
+            return True
+        return self.submit_control(self.SET_CH2_VR_REQUEST, self.SET_CH2_VR_VALUE, self.SET_CH2_VR_INDEX,
+                                   pack("B", range_index), timeout, on_done)
+
+
+    def submit_ch1_ch2_ac_dc(self, ac_dc, timeout=0):
+        """
+        Non-blocking variant of set_ch1_ch2_ac_dc, see submit_control. ac_dc_status is updated on completion.
+        :return: A Future for True if successful.
+        """
+        assert ac_dc == self.AC_AC or ac_dc == self.AC_DC or ac_dc == self.DC_AC or ac_dc == self.DC_DC
+        submitted = time.monotonic()
+        def on_done(length):
+            assert length == 0x01
+            self.ac_dc_status = ac_dc
+            self.record_config_change('ac_dc', ac_dc, submitted)
+            return True
+        return self.submit_control(self.SET_AC_DC_REQUEST, self.SET_AC_DC_VALUE, self.SET_AC_DC_INDEX,
+                                   pack("B", ac_dc), timeout, on_done)
+
+
+    def deinterleave(self, data):
+        """
+        Split a block of samples as delivered by the device into one row per active channel without copying.
+        :param data: The block of samples (bytes, bytearray, memoryview or anything else supporting the buffer protocol).
+        :return: A (num_channels, N) uint8 numpy array. Each row is a strided view into a single np.frombuffer of data,
+                 so it is only valid as long as data is not overwritten.
+        """
+        samples = np.frombuffer(data, dtype=np.uint8)
+        if self.num_channels == 2:
+            return samples[:len(samples) & ~0x1].reshape(-1, 2).T
+        return samples.reshape(1, -1)
+
+
+    def build_channel_splitter(self, raw=False, numpy=False):
+        """
+        Build the function used by all read paths to split a block of samples into CH1 and CH2 data.
+        :param raw: (OPTIONAL) Split into raw bytestrings. Default: Off
+        :param numpy: (OPTIONAL) Split into uint8 numpy views over the block, overrides raw. Default: Off
+        :return: A split function, which takes the block of samples and returns the CH1 and CH2 data. With one active
+                 channel the CH2 data is empty.
+        """
+        deinterleave = self.deinterleave
+        array_builder = array.array
+        zero_array = array_builder('B', [0])
+        no_data = np.empty(0, dtype=np.uint8)
+        if self.num_channels == 1 and numpy:
+            def split(data):
+                return deinterleave(data)[0], no_data
+        elif self.num_channels == 2 and numpy:
+            def split(data):
+                ch1_data, ch2_data = deinterleave(data)
+                return ch1_data, ch2_data
+        elif self.num_channels == 1 and raw:
+            def split(data):
+                return data, ''
+        elif self.num_channels == 2 and raw:
+            def split(data):
+                return data[::2], data[1::2]
+        elif self.num_channels == 1 and not raw:
+            def split(data):
+                return array_builder('B', data), array_builder('B')
+        elif self.num_channels == 2 and not raw:
+            # compatibility layer, the samples are deinterleaved straight from the numpy views into the arrays
+            def split(data):
+                ch1_data, ch2_data = deinterleave(data)
+                ch1_array, ch2_array = zero_array * len(ch1_data), zero_array * len(ch2_data)
+                np.frombuffer(ch1_array, dtype=np.uint8)[:] = ch1_data
+                np.frombuffer(ch2_array, dtype=np.uint8)[:] = ch2_data
+                return ch1_array, ch2_array
+        else:
+            # Should never be here.
+            assert False
+        return split
+
+
+    def read_data(self, data_size=0x400, raw=False, timeout=0, numpy=False):
         """
         Read both channel's ADC data from the device. No trigger support, you need to do this in software.
         :param data_size: (OPTIONAL) The number of data points for each channel to retrieve. Default: 0x400 points.
         :param raw: (OPTIONAL) Return the raw bytestrings from the scope. Default: Off
         :param timeout: (OPTIONAL) The timeout for each bulk transfer from the scope. Default: 0 (No timeout)
+        :param numpy: (OPTIONAL) Return uint8 numpy arrays, overrides raw. Default: Off
         :return: If raw, two bytestrings are returned, the first for CH1, the second for CH2. If raw is off, two
                  lists are returned (by iterating over the bytestrings and converting to ordinals). The lists contain
                  the ADC value measured at that time, which should be between 0 - 255.
+                 If numpy, two uint8 arrays are returned. With both channels active they are the rows of a single
+                 (2, N) strided view over the received data, no copy is made.
 
                  If you'd like nicely scaled data, just dump the return lists into the scale_read_data method with
                  your current voltage range setting.
@@ -492,20 +1488,14 @@ class Oscilloscope(object):
         self.start_capture()
         data = self.device_handle.bulkRead(0x86, data_size, timeout=timeout)
         self.stop_capture()
-        if self.num_channels == 2:
-            chdata = data[::2], data[1::2]
-        else:
-            chdata = data, ''
-        if raw:
-            return chdata
-        else:
-            return array.array('B', chdata[0]), array.array('B', chdata[1])
+        return self.build_channel_splitter(raw, numpy)(data)
 
 
-    def build_data_reader(self, raw=False):
+    def build_data_reader(self, raw=False, numpy=False):
         """
         Build a (slightly) more optimized reader closure, for (slightly) better performance.
         :param raw: (OPTIONAL) Return the raw bytestrings from the scope. Default: Off
+        :param numpy: (OPTIONAL) Return uint8 numpy views over the received data, overrides raw. Default: Off
         :return: A fast_read_data function, which behaves much like the read_data function. The fast_read_data
                  function returned takes two parameters:
                  :param data_size: Number of data points to return (1 point <-> 1 byte).
@@ -513,37 +1503,154 @@ class Oscilloscope(object):
                  :return:  If raw, two bytestrings are returned, the first for CH1, the second for CH2. If raw is off,
                  two lists are returned (by iterating over the bytestrings and converting to ordinals).
                  The lists contain the ADC value measured at that time, which should be between 0 - 255.
+                 If numpy, two uint8 arrays are returned.
 
         This method and the closure may assert or raise various libusb errors if something went/goes wrong.
         """
         if not self.device_handle:
             assert self.open_handle()
         scope_bulk_read = self.device_handle.bulkRead
-        array_builder = array.array
-        if self.num_channels == 1 and raw:
-            def fast_read_data(data_size, timeout=0):
-                data = scope_bulk_read(0x86, data_size, timeout)
-                return data, ''
-        elif self.num_channels == 1 and not raw:
-            def fast_read_data(data_size, timeout=0):
-                data = scope_bulk_read(0x86, data_size, timeout)
-                return array_builder('B', data), array_builder('B', '')
-        elif self.num_channels == 2 and raw:
+        split = self.build_channel_splitter(raw, numpy)
+        if self.num_channels == 1:
             def fast_read_data(data_size, timeout=0):
-                data_size <<= 0x1
-                data = scope_bulk_read(0x86, data_size, timeout)
-                return data[::2], data[1::2]
-        elif self.num_channels == 2 and not raw:
+                return split(scope_bulk_read(0x86, data_size, timeout))
+        elif self.num_channels == 2:
             def fast_read_data(data_size, timeout=0):
                 data_size <<= 0x1
-                data = scope_bulk_read(0x86, data_size, timeout)
-                return array_builder('B', data[::2]), array_builder('B', data[1::2])
+                return split(scope_bulk_read(0x86, data_size, timeout))
         else:
             # Should never be here.
             assert False
         return fast_read_data
 
 
+    def build_data_reader_into(self):
+        """
+        Build a reader closure which fills caller owned buffers instead of allocating new ones on every call.
+        The data is received directly into the buffer, with a single transfer reused for all reads.
+        :return: A fast_read_data_into function, which takes two parameters:
+                 :param buffer: A writable buffer (bytearray, memoryview, contiguous numpy array, ...) which receives the
+                                interleaved samples, its size in bytes is the number of bytes read. A (2, N) numpy
+                                array with both channels active receives CH1 in the first and CH2 in the second row.
+                 :param timeout: (OPTIONAL) The timeout for the bulk transfer from the scope. Default: 0 (No timeout)
+                 :return: The number of bytes received.
+
+        This method and the closure may assert or raise various libusb errors if something went/goes wrong.
+        """
+        if not self.device_handle:
+            assert self.open_handle()
+        transfer = self.device_handle.getTransfer()
+        is_submitted = transfer.isSubmitted
+        handle_events = self.context.handleEventsTimeout
+        num_channels = self.num_channels
+        np_copyto = np.copyto
+        ndarray = np.ndarray
+        # the transfer is only set up again when the buffer or the timeout changes
+        state = {'buffer': None, 'timeout': None, 'scratch': None}
+
+        def fast_read_data_into(buffer, timeout=0):
+            target = buffer
+            if num_channels == 2 and isinstance(buffer, ndarray) and buffer.ndim == 2 and buffer.shape[0] == 2:
+                # receive into a scratch block, the rows are filled from its deinterleaved view
+                if state['scratch'] is None or state['scratch'].size != buffer.size:
+                    state['scratch'] = np.empty(buffer.size, dtype=np.uint8)
+                target = state['scratch']
+            if target is not state['buffer'] or timeout != state['timeout']:
+                transfer.setBulk(0x86, memoryview(target).cast('B'), timeout=timeout)
+                state['buffer'] = target
+                state['timeout'] = timeout
+            transfer.submit()
+            # libusb serializes event handling, so this also works while an event thread is running
+            while is_submitted():
+                handle_events(0.1)
+            assert transfer.getStatus() == libusb1.LIBUSB_TRANSFER_COMPLETED, \
+                "read failed with transfer status {}".format(transfer.getStatus())
+            length = transfer.getActualLength()
+            if target is not buffer:
+                np_copyto(buffer, target.reshape(-1, 2).T)
+            return length
+        return fast_read_data_into
+
+
+    def get_settle_samples(self):
+        """
+        The number of samples per channel to discard at the start of a capture: the stale content of the FIFO and
+        the settling time at the current sample rate.
+        :return: The number of samples per channel.
+        """
+        rate = self.SAMPLE_RATES[self.sample_rate_index][1]
+        return self.FIFO_SIZE // self.num_channels + int(math.ceil(self.SETTLE_TIME * rate))
+
+
+    def arm(self, timeout=0):
+        """
+        Start capturing and keep the device armed for subsequent capture calls, which saves the start and stop
+        round trips of read_data.
+        :param timeout: (OPTIONAL) A timeout for the transfer. Default: 0 (No timeout)
+        :return: True if successful. May assert or raise various libusb errors if something went wrong.
+        """
+        if not self.device_handle:
+            assert self.open_handle()
+        self.armed = self.start_capture(timeout)
+        return self.armed
+
+
+    def disarm(self, timeout=0):
+        """
+        Stop capturing after arm.
+        :param timeout: (OPTIONAL) A timeout for the transfer. Default: 0 (No timeout)
+        :return: True if successful. May assert or raise various libusb errors if something went wrong.
+        """
+        self.armed = False
+        return self.stop_capture(timeout)
+
+
+    def capture(self, data_size=0x400, transfer_size=0x10000, outstanding_transfers=4, timeout=0):
+        """
+        Read both channel's ADC data from the armed device (arm is called if needed), like read_data(numpy=True).
+        The request is split into several transfers kept in flight at the same time, and exactly the samples given
+        by get_settle_samples are discarded. Only the bulk interface is supported.
+        :param data_size: (OPTIONAL) The number of data points for each channel to retrieve. Default: 0x400 points.
+        :param transfer_size: (OPTIONAL) The size of each transfer in bytes, rounded up to the endpoint packet size.
+                              Default: 64 KiB
+        :param outstanding_transfers: (OPTIONAL) The number of transfers in flight at the same time. Default: 4
+        :param timeout: (OPTIONAL) The timeout for each bulk transfer from the scope. Default: 0 (No timeout)
+        :return: Two uint8 numpy arrays, the first for CH1, the second for CH2 (empty with one active channel).
+                 Both are views into one contiguous buffer holding the received data.
+                 This method may assert or raise various libusb errors if something went wrong.
+        """
+        assert not self.is_iso
+        if not self.armed:
+            assert self.arm()
+        packetsize = self.packetsize
+        settle_size = self.get_settle_samples() * self.num_channels
+        total_size = settle_size + data_size * self.num_channels
+        total_size = (total_size + packetsize - 1) // packetsize * packetsize
+        transfer_size = (transfer_size + packetsize - 1) // packetsize * packetsize
+        data = np.empty(total_size, dtype=np.uint8)
+        chunks = [memoryview(data)[offset:offset + transfer_size] for offset in range(0, total_size, transfer_size)]
+        chunks.reverse()
+        failed = []
+        def transfer_callback(transfer):
+            if transfer.getStatus() != libusb1.LIBUSB_TRANSFER_COMPLETED \
+                    or transfer.getActualLength() != len(transfer.getBuffer()):
+                failed.append(transfer.getStatus())
+            elif chunks and not failed:
+                transfer.setBulk(0x86, chunks.pop(), callback=transfer_callback, timeout=timeout)
+                transfer.submit()
+        transfers = []
+        for _ in range(min(outstanding_transfers, len(chunks))):
+            transfer = self.device_handle.getTransfer()
+            transfer.setBulk(0x86, chunks.pop(), callback=transfer_callback, timeout=timeout)
+            transfer.submit()
+            transfers.append(transfer)
+        # libusb serializes event handling, so this also works while an event thread is running
+        while any(transfer.isSubmitted() for transfer in transfers):
+            self.context.handleEventsTimeout(0.1)
+        assert not failed, "capture failed with transfer status {}".format(failed[0])
+        return self.build_channel_splitter(numpy=True)(data[settle_size:settle_size + data_size * self.num_channels])
+
+
     def set_interface(self, alt):
         """
         Set the alternative interface (bulk or iso) to use.  This is only
@@ -565,111 +1672,598 @@ class Oscilloscope(object):
                        == libusb1.LIBUSB_TRANSFER_TYPE_ISOCHRONOUS)
         maxpacketsize = endpoint_info.getMaxPacketSize()
         self.packetsize = ((maxpacketsize >> 11)+1) * (maxpacketsize & 0x7ff)
+        self.interface_alt = alt
         return True
 
 
-    def read_async_iso(self, callback, packets, outstanding_transfers, raw):
+    def get_interface_bandwidth(self, alt):
+        """
+        The bandwidth of an alternative interface according to its endpoint descriptor.
+        :param int alt: The interface, see set_interface.
+        :return: The bandwidth reserved by an iso interface in bytes/s, or the bus maximum for the bulk interface,
+                 which is not reserved and shared with the other devices on the bus.
+        """
+        endpoint_info = self.device[0][0][alt][0]
+        if ((endpoint_info.getAttributes() & libusb1.LIBUSB_TRANSFER_TYPE_MASK)
+                != libusb1.LIBUSB_TRANSFER_TYPE_ISOCHRONOUS):
+            return self.MAX_BULK_BANDWIDTH
+        maxpacketsize = endpoint_info.getMaxPacketSize()
+        return int(round(((maxpacketsize >> 11)+1) * (maxpacketsize & 0x7ff) / self.get_packet_interval(alt)))
+
+
+    def get_packet_interval(self, alt=None):
+        """
+        The service interval of an iso interface according to its endpoint descriptor.
+        :param int alt: (OPTIONAL) The interface, see set_interface. Default: None (the current interface)
+        :return: The time between two iso packets in seconds.
+        """
+        endpoint_info = self.device[0][0][self.interface_alt if alt is None else alt][0]
+        # one packet each 2 ** (bInterval - 1) (micro)frames: 1 ms frames at full speed, e.g. behind a USB 1.1 hub,
+        # 125 us microframes at high speed
+        if self.device.getDeviceSpeed() in (libusb1.LIBUSB_SPEED_LOW, libusb1.LIBUSB_SPEED_FULL):
+            frame_time = 1e-3
+        else:
+            frame_time = 125e-6
+        return 2 ** (endpoint_info.getInterval() - 1) * frame_time
+
+
+    def get_required_bandwidth(self):
+        """
+        :return: The data rate in bytes/s at the current sample rate and number of channels.
+        """
+        return self.SAMPLE_RATES[self.sample_rate_index][1] * self.num_channels
+
+
+    def probe_throughput(self, duration=0.5, data_size=None):
+        """
+        Measure the throughput of the current interface with a short asynchronous capture. It must not run while
+        an async reader is active. The capture state of the device is restored afterwards.
+        :param duration: (OPTIONAL) The measurement time in seconds, extended to at least ten transfer times.
+                         Default: 0.5 s
+        :param data_size: (OPTIONAL) The block size to measure with, see read_async. Default: None (automatic)
+        :return: The received data rate in bytes/s, from the first to the last block completed in the measurement
+                 time. 0 if less than two blocks completed.
+        """
+        assert not any(not reader.is_set() for reader in self.async_readers), \
+            "probe_throughput can not run while an async reader is active"
+        was_capturing = self.capturing
+        blocks = []
+        def count_callback(ch1_data, ch2_data, info):
+            blocks.append((info.timestamp, sum(info.packet_lengths)))
+        if not was_capturing:
+            self.start_capture()
+        reader = self.read_async(count_callback, data_size, raw=True, metadata=True)
+        if reader.transfer_time:
+            # the rate is measured per block, the window must span many of them
+            duration = max(duration, 10 * reader.transfer_time)
+        # the first blocks hold the stale FIFO content, they are not counted
+        start_time = time.monotonic()
+        while time.monotonic() - start_time < duration / 4:
+            self.context.handleEventsTimeout(0.01)
+        del blocks[:]
+        start_time = time.monotonic()
+        while time.monotonic() - start_time < duration:
+            self.context.handleEventsTimeout(0.01)
+        if not was_capturing:
+            self.stop_capture()
+        reader.stop(timeout=1)
+        span = blocks[-1][0] - blocks[0][0] if blocks else 0
+        if span <= 0:
+            return 0
+        # the data of the first block arrived before the window opened by its completion
+        return sum(length for _, length in blocks[1:]) / span
+
+
+    def select_interface(self, headroom=1.02, probe_time=0.5):
+        """
+        Choose the transport for the current sample rate and number of channels: the iso interface with the least
+        reserved bandwidth that sustains the data rate with headroom, or the bulk interface if no iso interface is
+        fast enough or the bus refuses the reservation. The choice is checked with probe_throughput, falling back to
+        the next faster interface. Call this again after changing the sample rate or the number of channels.
+        Only supported with the custom firmware.
+        :param headroom: (OPTIONAL) The factor the bandwidth must exceed the data rate by. Default: 1.02
+        :param probe_time: (OPTIONAL) The duration of the throughput probe in seconds, 0 to skip it. Default: 0.5 s
+        :return: True if an interface sustaining the data rate was selected. Otherwise a warning is issued, the
+                 fastest interface measured stays selected and False is returned.
+        """
+        if not self.device_handle:
+            assert self.open_handle()
+        required = self.get_required_bandwidth()
+        if required > self.MAX_BULK_BANDWIDTH:
+            warnings.warn("{} bytes/s exceed the USB high speed bandwidth, samples will be lost".format(required))
+        alts = range(self.device[0][0].getNumSettings())
+        bandwidths = dict((alt, self.get_interface_bandwidth(alt)) for alt in alts)
+        # the cheapest iso interfaces first, bulk last
+        candidates = sorted((bandwidths[alt], alt) for alt in alts if alt and bandwidths[alt] >= required * headroom)
+        candidates = [alt for _, alt in candidates] + [0]
+        best_alt, best_throughput = 0, 0
+        for alt in candidates:
+            try:
+                self.set_interface(alt)
+            except usb1.USBError:
+                # the bus has no room left for the reservation
+                continue
+            if not probe_time:
+                return True
+            throughput = self.probe_throughput(probe_time)
+            # the device delivers no more than required, anything well below means lost samples
+            if throughput >= 0.95 * required:
+                return True
+            if throughput > best_throughput:
+                best_alt, best_throughput = alt, throughput
+        self.set_interface(best_alt)
+        warnings.warn("no interface sustains {} bytes/s, best measured {:.0f} bytes/s on interface {}".format(
+            required, best_throughput, best_alt))
+        return False
+
+
+    def build_block_deliverer(self, reader, callback, split, coalesce, metadata):
+        """
+        Internal function building the deliver function of the async readers, which splits a block, calls the user
+        callback with the arguments selected by coalesce and metadata, and isolates the reader from exceptions
+        raised by the callback.
+        """
+        if metadata:
+            def call(data, info):
+                callback(*split(data), info)
+        elif coalesce:
+            def call(data, info):
+                callback(*split(data), info.packet_lengths)
+        else:
+            def call(data, info):
+                callback(*split(data))
+        consumer_failed = reader.consumer_failed
+        def deliver(data, info):
+            try:
+                call(data, info)
+            except Exception as exception:
+                consumer_failed(exception)
+        return deliver
+
+
+    def create_async_reader(self, transfer_time, max_transfers, error_callback):
+        """
+        Internal function creating the AsyncReader of read_async_iso and read_async_bulk. The settings in effect from
+        the first sample on are recorded before any transfer is submitted, so the first completions already see them.
+        """
+        reader = AsyncReader(self.context, transfer_time, max_transfers, error_callback)
+        reader.sample_rate = self.SAMPLE_RATES.get(self.sample_rate_index, (None, None))[1]
+        if reader.sample_rate:
+            reader.clock = SampleClock(reader.sample_rate)
+        reader.config_events = [ConfigEvent(0, 0, setting, value, None, None) for setting, value in
+                                [('sample_rate', self.sample_rate_index), ('ch1_voltage_range', self.ch1_voltage_range),
+                                 ('ch2_voltage_range', self.ch2_voltage_range), ('ac_dc', self.ac_dc_status)]]
+        self.async_readers.append(reader)
+        return reader
+
+
+    def read_async_iso(self, callback, packets, outstanding_transfers, raw, numpy=False, coalesce=False,
+                       metadata=False, transfer_time=None, max_transfers=0, lend=False, pool_size=None,
+                       error_callback=None):
         """
         Internal function to read from isochronous channel.  External
         users should call read_async.
         """
-        array_builder = array.array
-        shutdown_event = threading.Event()
-        shutdown_is_set = shutdown_event.is_set
-        if self.num_channels == 1 and raw:
-            def transfer_callback(iso_transfer):
-                for (status, data) in iso_transfer.iterISO():
-                    callback(data, '')
-                if not shutdown_is_set():
-                    iso_transfer.submit()
-        elif self.num_channels == 1 and not raw:
-            def transfer_callback(iso_transfer):
-                for (status, data) in iso_transfer.iterISO():
-                    callback(array_builder('B', data), [])
-                if not shutdown_is_set():
-                    iso_transfer.submit()
-        elif self.num_channels == 2 and raw:
-            def transfer_callback(iso_transfer):
-                for (status, data) in iso_transfer.iterISO():
-                    callback(data[::2], data[1::2])
-                if not shutdown_is_set():
-                    iso_transfer.submit()
-        elif self.num_channels == 2 and not raw:
-            def transfer_callback(iso_transfer):
-                for (status, data) in iso_transfer.iterISO():
-                    callback(array_builder('B', data[::2]), array_builder('B', data[1::2]))
-                if not shutdown_is_set():
-                    iso_transfer.submit()
+        split = self.build_channel_splitter(raw, numpy)
+        reader = self.create_async_reader(transfer_time, max_transfers, error_callback)
+        track_completion = reader.track_completion
+        submit = reader.submit
+        num_channels = self.num_channels
+        packetsize = self.packetsize
+        block_size = packets * packetsize
+        offsets = range(0, block_size, packetsize)
+        # short packets are compacted into this buffer, shared by all transfers as callbacks never overlap
+        block = memoryview(bytearray(block_size))
+        completed = libusb1.LIBUSB_TRANSFER_COMPLETED
+        cancelled = libusb1.LIBUSB_TRANSFER_CANCELLED
+        keep_view = numpy or (lend and raw)
+        if lend:
+            coalesce = metadata = True
+            reader.pool = BufferPool(block_size, pool_size or 2 * outstanding_transfers)
+            acquire, release = reader.pool.acquire, reader.pool.release
         else:
-            assert False
-        for _ in range(outstanding_transfers):
+            # a completed buffer is swapped against the spare before resubmitting, so it is not overwritten while
+            # it is delivered. The callbacks never overlap, so one spare serves all transfers.
+            spare = [bytearray(block_size)]
+        deliver = self.build_block_deliverer(reader, callback, split, coalesce, metadata)
+        def transfer_callback(iso_transfer):
+            if iso_transfer.getStatus() == cancelled:
+                return
+            timestamp = time.monotonic()
+            if max_transfers:
+                track_completion(timestamp)
+            buffer = memoryview(iso_transfer.getBuffer())
+            setup_list = iso_transfer.getISOSetupList()
+            packet_lengths = [setup['actual_length'] for setup in setup_list]
+            failed = [setup['status'] != completed for setup in setup_list]
+            received = sum(packet_lengths)
+            failed_packets = sum(failed)
+            short_packets = sum(1 for length, fail in zip(packet_lengths, failed) if not fail and length < packetsize)
+            # a failed packet is assumed to have been as long as the good ones
+            good_packets = len(setup_list) - failed_packets
+            lost_per_packet = received // good_packets if good_packets and received else packetsize
+            self.bytes_received += received
+            self.packets_in_error += failed_packets
+            self.samples_lost += failed_packets * lost_per_packet // num_channels
+            sequence = reader.sequence
+            reader.sequence += 1
+            # resubmit first, so a slow or failing consumer never starves the transfer queue. The received buffer
+            # is swapped out before, the transfer must not write into it while it is delivered.
+            if lend:
+                # swap a fresh buffer into the transfer, the consumer gives the old one back by release()
+                lent = iso_transfer.getBuffer()
+                iso_transfer.setBuffer(acquire())
+            else:
+                received_buffer = iso_transfer.getBuffer()
+                iso_transfer.setBuffer(spare[0])
+                spare[0] = received_buffer
+            submit(iso_transfer)
+            if coalesce:
+                # a lent buffer is compacted in place, the data only moves towards its start
+                target = buffer if lend else block
+                if received == block_size:
+                    data = buffer
+                else:
+                    position = 0
+                    for offset, length in zip(offsets, packet_lengths):
+                        target[position:position + length] = buffer[offset:offset + length]
+                        position += length
+                    data = target[0:position]
+                info = BlockInfo(reader.sample_index, sequence, timestamp, packet_lengths,
+                                 failed_packets, short_packets)
+                if lend:
+                    info = info._replace(release=partial(release, lent))
+                reader.sample_index += (received + failed_packets * lost_per_packet) // num_channels
+                reader.sample_time = timestamp
+                if reader.clock:
+                    reader.clock.add(reader.sample_index, timestamp)
+                deliver(data if keep_view else data.tobytes(), info)
+            else:
+                for offset, length, fail in zip(offsets, packet_lengths, failed):
+                    data = buffer[offset:offset + length]
+                    info = BlockInfo(reader.sample_index, sequence, timestamp, [length],
+                                     int(fail), int(not fail and length < packetsize))
+                    reader.sample_index += (lost_per_packet if fail else length) // num_channels
+                    reader.sample_time = timestamp
+                    if reader.clock:
+                        reader.clock.add(reader.sample_index, timestamp)
+                    deliver(data if numpy else data.tobytes(), info)
+        def new_transfer():
             transfer = self.device_handle.getTransfer(iso_packets=packets)
-            transfer.setIsochronous(0x82, (packets*self.packetsize), callback=transfer_callback)
-            transfer.submit()
-        return shutdown_event
+            transfer.setIsochronous(0x82, acquire() if lend else block_size, callback=transfer_callback)
+            reader.submit(transfer, new=True)
+        reader.new_transfer = new_transfer
+        for _ in range(outstanding_transfers):
+            new_transfer()
+        return reader
 
 
-    def read_async_bulk(self, callback, packets, outstanding_transfers, raw):
+    def read_async_bulk(self, callback, packets, outstanding_transfers, raw, numpy=False, coalesce=False,
+                        metadata=False, transfer_time=None, max_transfers=0, lend=False, pool_size=None,
+                        error_callback=None):
         """
         Internal function to read from bulk channel.  External
         users should call read_async.
         """
-        array_builder = array.array
-        shutdown_event = threading.Event()
-        shutdown_is_set = shutdown_event.is_set
-        if self.num_channels == 1 and raw:
-            def transfer_callback(bulk_transfer):
-                data = bulk_transfer.getBuffer()[0:bulk_transfer.getActualLength()]
-                callback(data, '')
-                if not shutdown_is_set():
-                    bulk_transfer.submit()
-        elif self.num_channels == 1 and not raw:
-            def transfer_callback(bulk_transfer):
-                data = bulk_transfer.getBuffer()[0:bulk_transfer.getActualLength()]
-                callback(array_builder('B', data), [])
-                if not shutdown_is_set():
-                    bulk_transfer.submit()
-        elif self.num_channels == 2 and raw:
-            def transfer_callback(bulk_transfer):
-                data = bulk_transfer.getBuffer()[0:bulk_transfer.getActualLength()]
-                callback(data[::2], data[1::2])
-                if not shutdown_is_set():
-                    bulk_transfer.submit()
-        elif self.num_channels == 2 and not raw:
-            def transfer_callback(bulk_transfer):
-                data = bulk_transfer.getBuffer()[0:bulk_transfer.getActualLength()]
-                callback(array_builder('B', data[::2]), array_builder('B', data[1::2]))
-                if not shutdown_is_set():
-                    bulk_transfer.submit()
+        split = self.build_channel_splitter(raw, numpy)
+        reader = self.create_async_reader(transfer_time, max_transfers, error_callback)
+        track_completion = reader.track_completion
+        submit = reader.submit
+        num_channels = self.num_channels
+        transfer_size = packets * self.packetsize
+        completed = libusb1.LIBUSB_TRANSFER_COMPLETED
+        cancelled = libusb1.LIBUSB_TRANSFER_CANCELLED
+        if lend:
+            metadata = True
+            reader.pool = BufferPool(transfer_size, pool_size or 2 * outstanding_transfers)
+            acquire, release = reader.pool.acquire, reader.pool.release
         else:
-            assert False
-        for _ in range(outstanding_transfers):
+            # a completed buffer is swapped against the spare before resubmitting, so it is not overwritten while
+            # it is delivered. The callbacks never overlap, so one spare serves all transfers.
+            spare = [bytearray(transfer_size)]
+        deliver = self.build_block_deliverer(reader, callback, split, coalesce, metadata)
+        def transfer_callback(bulk_transfer):
+            if bulk_transfer.getStatus() == cancelled:
+                return
+            timestamp = time.monotonic()
+            if max_transfers:
+                track_completion(timestamp)
+            length = bulk_transfer.getActualLength()
+            failed = bulk_transfer.getStatus() != completed
+            # whatever did not arrive with a failed transfer is assumed to be lost
+            lost = transfer_size - length if failed else 0
+            self.bytes_received += length
+            self.packets_in_error += failed
+            self.samples_lost += lost // num_channels
+            sequence = reader.sequence
+            reader.sequence += 1
+            info = BlockInfo(reader.sample_index, sequence, timestamp, [length],
+                             int(failed), int(not failed and length < transfer_size))
+            reader.sample_index += (length + lost) // num_channels
+            reader.sample_time = timestamp
+            if reader.clock:
+                reader.clock.add(reader.sample_index, timestamp)
+            if lend:
+                # swap a fresh buffer into the transfer, the consumer gives the old one back by release()
+                lent = bulk_transfer.getBuffer()
+                bulk_transfer.setBuffer(acquire())
+                data = memoryview(lent)[0:length]
+                if not (numpy or raw):
+                    data = data.tobytes()
+                info = info._replace(release=partial(release, lent))
+            else:
+                received_buffer = bulk_transfer.getBuffer()
+                bulk_transfer.setBuffer(spare[0])
+                spare[0] = received_buffer
+                # the numpy views handed to the callback point into the received buffer itself
+                data = memoryview(received_buffer)[0:length] if numpy else received_buffer[0:length]
+            # resubmit first, so a slow or failing consumer never starves the transfer queue
+            submit(bulk_transfer)
+            deliver(data, info)
+        def new_transfer():
             transfer = self.device_handle.getTransfer(iso_packets=packets)
-            transfer.setBulk(0x86, (packets*self.packetsize), callback=transfer_callback)
-            transfer.submit()
-        return shutdown_event
+            transfer.setBulk(0x86, acquire() if lend else transfer_size, callback=transfer_callback)
+            reader.submit(transfer, new=True)
+        reader.new_transfer = new_transfer
+        for _ in range(outstanding_transfers):
+            new_transfer()
+        return reader
 
 
-    def read_async(self, callback, data_size, outstanding_transfers=3, raw=False):
+    def get_transfer_parameters(self, latency=0.01, drop_tolerance=0.1):
+        """
+        Derive the transfer size and the number of outstanding transfers for read_async from the current sample rate,
+        the number of active channels and the endpoint packet size of the current interface.
+        :param latency: (OPTIONAL) The time span covered by one transfer, i.e. how long it takes until a block is
+                        delivered. Default: 10 ms
+        :param drop_tolerance: (OPTIONAL) How long the host may be late in handling completed transfers without losing
+                               samples, i.e. the time span covered by all outstanding transfers. Default: 100 ms
+        :return: The data_size and the number of outstanding transfers to use, and the time span covered by one
+                 transfer in seconds.
+        """
+        if not self.packetsize:
+            assert self.set_interface(0)
+        bytes_per_second = self.SAMPLE_RATES[self.sample_rate_index][1] * self.num_channels
+        if self.is_iso:
+            # one iso packet per service interval, whatever the sample rate is
+            interval = self.get_packet_interval()
+            packets = max(1, int(math.ceil(latency / interval)))
+            transfer_time = packets * interval
+        else:
+            packets = max(1, int(round(latency * bytes_per_second / self.packetsize)))
+            transfer_time = packets * self.packetsize / bytes_per_second
+        outstanding_transfers = max(3, int(math.ceil(drop_tolerance / transfer_time)) + 1)
+        return packets * self.packetsize, outstanding_transfers, transfer_time
+
+
+    def read_async(self, callback, data_size=None, outstanding_transfers=3, raw=False, numpy=False, coalesce=False,
+                   metadata=False, latency=0.01, drop_tolerance=0.1, max_transfers=64, lend=False, pool_size=None,
+                   error_callback=None):
         """
         Read both channel's ADC data from the device asynchronously. No trigger support, you need to do this in software.
         The function returns immediately but the data is then sent asynchronously to the callback function whenever it
         receives new samples.
         :param callback: A function with two arguments that take the samples for the first and second channel.
+                         A PyHT6022.RingBuffer.RingBuffer instance can be passed to collect the samples.
         :param data_size: The block size for each sample.  This is automatically rounded up to the nearest multiple of
-                          the native block size.
+                          the native block size.  If None, the block size and the number of outstanding transfers are
+                          derived from latency and drop_tolerance by get_transfer_parameters, and more transfers are
+                          submitted at runtime whenever the completion jitter shows the queue is running dry.
         :param int outstanding_transfers: (OPTIONAL) The number of transfers sent to the kernel at the same time to
                 improve gapless sampling.  The higher, the more likely it works, but the more resources it will take.
         :param raw: (OPTIONAL) Whether the samples should be returned as raw string (8-bit data) or as an array of bytes.
-        :return: Returns a shutdown event handle if successful (and then calls the callback asynchronously).
-                 Call set() on the returned event to stop sampling.
+        :param numpy: (OPTIONAL) Hand the samples to the callback as uint8 numpy views, overrides raw. The views point
+                      into the transfer buffer and are only valid until the callback returns, copy them if you need
+                      to keep them. Default: Off
+        :param coalesce: (OPTIONAL) Gather all iso packets of a completed transfer into one contiguous block and call
+                         the callback once per transfer instead of once per iso packet. The callback then takes a
+                         third argument, the list of per-packet lengths of the block (a single length for bulk
+                         transfers, which always deliver one block per transfer). Default: Off
+        :param metadata: (OPTIONAL) Call the callback with a BlockInfo as third argument, which tells the index of the
+                         first sample of the block, the transfer sequence number, the host completion timestamp
+                         (time.monotonic), the per-packet lengths and the number of failed and short packets. With
+                         coalesce the BlockInfo replaces the list of packet lengths. Default: Off
+        :param latency: (OPTIONAL) Only used without data_size, see get_transfer_parameters. Default: 10 ms
+        :param drop_tolerance: (OPTIONAL) Only used without data_size, see get_transfer_parameters. Default: 100 ms
+        :param max_transfers: (OPTIONAL) Only used without data_size, the limit for the number of outstanding
+                              transfers when adapting at runtime. Default: 64
+        :param lend: (OPTIONAL) Zero-copy delivery: hand the transfer buffer itself to the callback (as numpy views,
+                     or memoryviews if raw) and swap a fresh buffer from the preallocated pool reader.pool into the
+                     transfer, which is resubmitted before the callback runs. Implies metadata, and coalesce for iso
+                     transfers. The data stays valid until the consumer calls release() on the BlockInfo of the block,
+                     which returns the buffer to the pool. Default: Off
+        :param pool_size: (OPTIONAL) Only used with lend, the number of preallocated buffers. The pool grows if the
+                          consumer holds all of them. Default: twice the number of outstanding transfers
+        :param error_callback: (OPTIONAL) A function called with every exception raised by the callback. Transfers
+                               are always resubmitted before the callback runs, so a failing or slow callback never
+                               starves the transfer queue. The exceptions are counted in the errors attribute of the
+                               returned reader as well. Default: None
+        :return: Returns an AsyncReader if successful (and then calls the callback asynchronously).
+                 Call stop() on the returned reader to stop sampling, it returns as soon as all transfers are done.
+                 Configuration changes made while reading are tagged with their first affected sample in the
+                 reader's config_events, see scale_read_data_segments. The reader's clock gives the time each
+                 sample was taken, e.g. reader.clock.time_of(info.sample_index).
         """
+        # forget the readers which are completely done
+        self.async_readers = [reader for reader in self.async_readers
+                              if not reader.is_set() or any(transfer.isSubmitted() for transfer in reader.transfers)]
+        transfer_time = None
+        if data_size is None:
+            data_size, outstanding_transfers, transfer_time = self.get_transfer_parameters(latency, drop_tolerance)
+            max_transfers = max(max_transfers, outstanding_transfers)
+        else:
+            max_transfers = 0
         # data_size to packets
         packets = (data_size + self.packetsize-1)//self.packetsize
         if self.is_iso:
-            return self.read_async_iso(callback, packets, outstanding_transfers, raw)
+            reader = self.read_async_iso(callback, packets, outstanding_transfers, raw, numpy, coalesce, metadata,
+                                         transfer_time, max_transfers, lend, pool_size, error_callback)
+        else:
+            reader = self.read_async_bulk(callback, packets, outstanding_transfers, raw, numpy, coalesce, metadata,
+                                          transfer_time, max_transfers, lend, pool_size, error_callback)
+        return reader
+
+
+    def build_block_queuer(self, put_block, queue_full, numpy, metadata):
+        """
+        Internal function building the read_async callback of stream and astream, which queues every block
+        (with metadata and coalesce set) and counts the blocks not fitting into the queue.
+        """
+        if numpy:
+            # the views are only valid inside the callback
+            def block_callback(ch1_data, ch2_data, info):
+                try:
+                    put_block((ch1_data.copy(), ch2_data.copy(), info) if metadata else
+                              (ch1_data.copy(), ch2_data.copy()))
+                except queue_full:
+                    self.dropped_blocks += 1
         else:
-            return self.read_async_bulk(callback, packets, outstanding_transfers, raw)
+            def block_callback(ch1_data, ch2_data, info):
+                try:
+                    put_block((ch1_data, ch2_data, info) if metadata else (ch1_data, ch2_data))
+                except queue_full:
+                    self.dropped_blocks += 1
+        return block_callback
+
+
+    def stream(self, data_size=None, outstanding_transfers=3, raw=False, numpy=False, queue_size=64, timeout=None,
+               metadata=False):
+        """
+        Capture continuously and iterate over the received blocks, e.g. "for ch1, ch2 in scope.stream(0x4000)".
+        Capturing starts with the first iteration and stops when the iteration ends, the libusb events are handled
+        on the event thread meanwhile.
+        :param data_size: (OPTIONAL) The block size for each sample, see read_async. Default: None (automatic)
+        :param int outstanding_transfers: (OPTIONAL) The number of transfers sent to the kernel, see read_async.
+        :param raw: (OPTIONAL) Whether the samples should be returned as raw string (8-bit data) or as an array of bytes.
+        :param numpy: (OPTIONAL) Return the samples as uint8 numpy arrays, overrides raw. Default: Off
+        :param queue_size: (OPTIONAL) The number of received blocks buffered for the consumer. If the consumer falls
+                           behind, new blocks are dropped and counted in dropped_blocks. Default: 64 blocks
+        :param timeout: (OPTIONAL) Maximum time to wait for a block in seconds, queue.Empty is raised when it expires.
+                        Default: None (wait forever)
+        :param metadata: (OPTIONAL) Yield the BlockInfo of each block as third item, see read_async. Default: Off
+        :return: A generator yielding one (CH1, CH2) tuple per completed transfer.
+                 May assert or raise various libusb errors if something went wrong.
+        """
+        if not self.device_handle:
+            assert self.open_handle()
+        blocks = queue.Queue(queue_size)
+        put_block = blocks.put_nowait
+        block_callback = self.build_block_queuer(put_block, queue.Full, numpy, metadata)
+        self.start_capture()
+        reader = self.read_async(block_callback, data_size, outstanding_transfers, raw, numpy,
+                                 coalesce=True, metadata=True)
+        # an event thread started by the caller keeps running afterwards
+        own_event_thread = self.event_thread.thread is None
+        self.start_event_thread()
+        try:
+            while True:
+                yield blocks.get(timeout=timeout)
+        finally:
+            self.stop_capture()
+            reader.stop()
+            if own_event_thread:
+                self.stop_event_thread()
+
+
+    async def astream(self, data_size=None, outstanding_transfers=3, raw=False, numpy=False, queue_size=64,
+                      metadata=False):
+        """
+        The asyncio variant of stream, e.g. "async for ch1, ch2 in scope.astream(0x4000)". The libusb events are
+        handled by the running event loop through the libusb pollfds, so no event thread or poll() calls are needed.
+        Not available on platforms where libusb has no pollfds (Windows), NotImplementedError is raised there.
+        :param data_size: (OPTIONAL) The block size for each sample, see read_async. Default: None (automatic)
+        :param int outstanding_transfers: (OPTIONAL) The number of transfers sent to the kernel, see read_async.
+        :param raw: (OPTIONAL) Whether the samples should be returned as raw string (8-bit data) or as an array of bytes.
+        :param numpy: (OPTIONAL) Return the samples as uint8 numpy arrays, overrides raw. Default: Off
+        :param queue_size: (OPTIONAL) The number of received blocks buffered for the consumer. If the consumer falls
+                           behind, new blocks are dropped and counted in dropped_blocks. Default: 64 blocks
+        :param metadata: (OPTIONAL) Yield the BlockInfo of each block as third item, see read_async. Default: Off
+        :return: An asynchronous generator yielding one (CH1, CH2) tuple per completed transfer.
+                 May assert or raise various libusb errors if something went wrong.
+        """
+        if not self.device_handle:
+            assert self.open_handle()
+        loop = asyncio.get_running_loop()
+        blocks = asyncio.Queue(queue_size)
+
+        def queue_block(block):
+            try:
+                blocks.put_nowait(block)
+            except asyncio.QueueFull:
+                self.dropped_blocks += 1
+
+        # the events may also be handled on another thread (e.g. the event thread), so the blocks are handed over
+        # to the loop instead of being queued directly
+        def put_block(block):
+            loop.call_soon_threadsafe(queue_block, block)
+        block_callback = self.build_block_queuer(put_block, asyncio.QueueFull, numpy, metadata)
+        self.acquire_asyncio_events(loop)
+        try:
+            assert await asyncio.wrap_future(self.submit_start_capture())
+            reader = self.read_async(block_callback, data_size, outstanding_transfers, raw, numpy,
+                                     coalesce=True, metadata=True)
+            try:
+                while True:
+                    yield await blocks.get()
+            finally:
+                await asyncio.wrap_future(self.submit_stop_capture())
+                reader.stop()
+        finally:
+            self.release_asyncio_events()
+
+
+    def acquire_asyncio_events(self, loop):
+        """
+        Internal function letting the running loop handle the libusb events, until release_asyncio_events is called
+        as often.
+        """
+        if self.asyncio_event_handler is None:
+            event_handler = AsyncioEventHandler(self.context, loop)
+            event_handler.start()
+            self.asyncio_event_handler = event_handler
+        self.asyncio_event_users += 1
+
+
+    def release_asyncio_events(self):
+        """
+        Internal function, see acquire_asyncio_events.
+        """
+        self.asyncio_event_users -= 1
+        if not self.asyncio_event_users:
+            self.asyncio_event_handler.stop()
+            self.asyncio_event_handler = None
+
+
+    async def await_control(self, future):
+        """
+        Internal function awaiting a Future of the control queue, the running loop handles the events meanwhile.
+        """
+        self.acquire_asyncio_events(asyncio.get_running_loop())
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            self.release_asyncio_events()
+
+
+    async def aset_sample_rate(self, rate_index, timeout=0):
+        """
+        Awaitable variant of set_sample_rate, sent through the control queue without blocking the event loop.
+        """
+        return await self.await_control(self.submit_sample_rate(rate_index, timeout))
+
+
+    async def aset_ch1_voltage_range(self, range_index, timeout=0):
+        """
+        Awaitable variant of set_ch1_voltage_range, sent through the control queue without blocking the event loop.
+        """
+        return await self.await_control(self.submit_ch1_voltage_range(range_index, timeout))
+
+
+    async def aset_ch2_voltage_range(self, range_index, timeout=0):
+        """
+        Awaitable variant of set_ch2_voltage_range, sent through the control queue without blocking the event loop.
+        """
+        return await self.await_control(self.submit_ch2_voltage_range(range_index, timeout))
 
 
     def scale_read_data( self, read_data, voltage_range=1, channel=1, probe=1, offset=0 ):
@@ -695,6 +2289,26 @@ class Oscilloscope(object):
         return [ ( datum - 128 - off ) * scale_factor for datum in read_data ]
 
 
+    def scale_read_data_segments( self, read_data, sample_index, reader, channel=1, probe=1, offset=0 ):
+        """
+        Like scale_read_data, but for a block of a running read_async: each part of the block is scaled with the
+        voltage range that was in effect when it was sampled, as tagged in the reader's config_events.
+        :param list read_data: The samples of one channel, as delivered to the read_async callback.
+        :param int sample_index: The index of the first sample, see BlockInfo.sample_index.
+        :param reader: The AsyncReader returned by read_async.
+        :param int channel: 1 = CH1, 2 = CH2.
+        :param int probe: (OPTIONAL) An additonal multiplictive factor for changing the probe gain. Default: 1
+        :param int offset: (OPTIONAL) An additional additive value to compensate the ADC offset
+        :return: A list of correctly scaled voltages for the data.
+        """
+        scaled = []
+        setting = 'ch{}_voltage_range'.format(channel)
+        for start, end, voltage_range in reader.get_segments(setting, sample_index, len(read_data)):
+            assert voltage_range is not None, "the voltage range of CH{} was never set".format(channel)
+            scaled.extend(self.scale_read_data(read_data[start:end], voltage_range, channel, probe, offset))
+        return scaled
+
+
     def voltage_to_adc( self, voltage, voltage_range=1, channel=1, probe=1, offset=0 ):
         """
         Convenience function for analog voltages into the ADC count the scope would see.
@@ -738,7 +2352,8 @@ class Oscilloscope(object):
     def set_sample_rate(self, rate_index, timeout=0):
         """
         Set the sample rate index for the scope to sample at. This determines the time between each point the scope
-        returns.
+        returns. Running async readers keep the size of their transfers, which was derived from the previous rate, so
+        the latency of bulk transfers changes with the rate. Restart the reader to size the transfers for the new rate.
         :param rate_index: The rate_index. These are the keys for the SAMPLE_RATES dict for the Oscilloscope object.
                            Common rate_index values and actual sample rate per channel:
                            102 <->  20 kS/s
@@ -768,11 +2383,14 @@ class Oscilloscope(object):
         """
         if not self.device_handle:
             assert self.open_handle()
+        submitted = time.monotonic()
         bytes_written = self.device_handle.controlWrite(0x40, self.SET_SAMPLE_RATE_REQUEST,
                                                         self.SET_SAMPLE_RATE_VALUE,
                                                         self.SET_SAMPLE_RATE_INDEX,
                                                         pack("B", rate_index), timeout=timeout)
         assert bytes_written == 0x01
+        self.sample_rate_index = rate_index
+        self.record_config_change('sample_rate', rate_index, submitted)
         return True
 
 
@@ -828,11 +2446,14 @@ class Oscilloscope(object):
         """
         if not self.device_handle:
             assert self.open_handle()
+        submitted = time.monotonic()
         bytes_written = self.device_handle.controlWrite(0x40, self.SET_CH1_VR_REQUEST,
                                                         self.SET_CH1_VR_VALUE,
                                                         self.SET_CH1_VR_INDEX,
                                                         pack("B", range_index), timeout=timeout)
         assert bytes_written == 0x01
+        self.ch1_voltage_range = range_index
+        self.record_config_change('ch1_voltage_range', range_index, submitted)
         return True
 
 
@@ -853,11 +2474,14 @@ class Oscilloscope(object):
         """
         if not self.device_handle:
             assert self.open_handle()
+        submitted = time.monotonic()
         bytes_written = self.device_handle.controlWrite(0x40, self.SET_CH2_VR_REQUEST,
                                                         self.SET_CH2_VR_VALUE,
                                                         self.SET_CH2_VR_INDEX,
                                                         pack("B", range_index), timeout=timeout)
         assert bytes_written == 0x01
+        self.ch2_voltage_range = range_index
+        self.record_config_change('ch2_voltage_range', range_index, submitted)
         return True
 
 
@@ -907,12 +2531,14 @@ class Oscilloscope(object):
         assert ac_dc == self.AC_AC or ac_dc == self.AC_DC or ac_dc == self.DC_AC or ac_dc == self.DC_DC
         if not self.device_handle:
             assert self.open_handle()
+        submitted = time.monotonic()
         bytes_written = self.device_handle.controlWrite(0x40, self.SET_AC_DC_REQUEST,
                                                         self.SET_AC_DC_VALUE,
                                                         self.SET_AC_DC_INDEX,
                                                         pack("B", ac_dc), timeout=timeout)
         assert bytes_written == 0x01
         self.ac_dc_status = ac_dc
+        self.record_config_change('ac_dc', ac_dc, submitted)
         return True
 
 
@@ -929,12 +2555,14 @@ class Oscilloscope(object):
         if not self.device_handle:
             assert self.open_handle()
         ac_dc_new = ( self.ac_dc_status & 0xF0 ) | ac_dc
+        submitted = time.monotonic()
         bytes_written = self.device_handle.controlWrite(0x40, self.SET_AC_DC_REQUEST,
                                                         self.SET_AC_DC_VALUE,
                                                         self.SET_AC_DC_INDEX,
                                                         pack("B", ac_dc_new), timeout=timeout)
         assert bytes_written == 0x01
         self.ac_dc_status = ac_dc_new # remember the latest status
+        self.record_config_change('ac_dc', ac_dc_new, submitted)
         return True
 
 
@@ -951,10 +2579,12 @@ class Oscilloscope(object):
         if not self.device_handle:
             assert self.open_handle()
         ac_dc_new = ( self.ac_dc_status & 0x0F ) | ac_dc << 4
+        submitted = time.monotonic()
         bytes_written = self.device_handle.controlWrite(0x40, self.SET_AC_DC_REQUEST,
                                                         self.SET_AC_DC_VALUE,
                                                         self.SET_AC_DC_INDEX,
                                                         pack("B", ac_dc_new), timeout=timeout)
         assert bytes_written == 0x01
         self.ac_dc_status = ac_dc_new # remember the latest status
+        self.record_config_change('ac_dc', ac_dc_new, submitted)
         return True
@@ -0,0 +1,145 @@
+import time
+import usb1
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PyHT6022.LibUsbScope import Oscilloscope, USBEventThread, DeviceRegistry
+
+
+ScopeInfo = namedtuple('ScopeInfo', ['port_path', 'vendor_id', 'product_id', 'firmware_present', 'serial'])
+
+
+class MultiScope(object):
+    """
+    Drives several scopes from one process: all devices share one libusb context and one event thread, flashing and
+    configuration run in parallel, and the counters of every device are kept apart.
+    """
+    def __init__(self, context=None):
+        """
+        :param context: (OPTIONAL) The usb1.USBContext shared by all scopes. Default: None (create one)
+        """
+        self.context = context or usb1.USBContext()
+        # the scopes find their devices in one shared view of the bus
+        self.registry = DeviceRegistry(self.context)
+        self.event_thread = USBEventThread(self.context)
+        self.scopes = []
+        self.readers = []
+        self.start_time = None
+        self.start_bytes = []
+
+    def enumerate(self, with_serial=False):
+        """
+        List the attached scopes.
+        :param with_serial: (OPTIONAL) Read the serial number, which needs to open each device. Default: Off
+        :return: A ScopeInfo for each scope, sorted by port path.
+        """
+        self.registry.update()
+        infos = []
+        for entry in self.registry.get_all():
+            serial = None
+            if with_serial:
+                try:
+                    serial = entry.device.getSerialNumber()
+                except usb1.USBError:
+                    pass
+            infos.append(ScopeInfo(entry.port_path, entry.vendor_id, entry.product_id, entry.firmware_present,
+                                   serial))
+        return infos
+
+    def open(self, port_paths=None, serials=None):
+        """
+        Create and open an Oscilloscope for the selected scopes.
+        :param port_paths: (OPTIONAL) Only use the scopes at these port paths, in this order. Default: None (all)
+        :param serials: (OPTIONAL) Only use the scopes with these serial numbers, in this order. Default: None (all)
+        :return: The list of Oscilloscope instances. May raise various libusb errors if something went wrong.
+        """
+        infos = self.enumerate(with_serial=serials is not None)
+        if port_paths is not None:
+            infos = [info for port_path in port_paths for info in infos if info.port_path == tuple(port_path)]
+        if serials is not None:
+            infos = [info for serial in serials for info in infos if info.serial == serial]
+        self.scopes = [Oscilloscope(context=self.context, device=self.registry.get(info.port_path).device,
+                                    registry=self.registry) for info in infos]
+        for scope in self.scopes:
+            assert scope.setup()
+            assert scope.open_handle()
+        return self.scopes
+
+    def call_all(self, method, *args, **kwargs):
+        """
+        Call an Oscilloscope method on all scopes in parallel, e.g. call_all('set_sample_rate', 10).
+        :param method: The name of the method.
+        :return: The list of results, in the order of the scopes. Exceptions are raised in the caller.
+        """
+        if not self.scopes:
+            return []
+        with ThreadPoolExecutor(len(self.scopes)) as executor:
+            futures = [executor.submit(getattr(scope, method), *args, **kwargs) for scope in self.scopes]
+            return [future.result() for future in futures]
+
+    def flash_all(self, firmware=None, timeout=60):
+        """
+        Flash the firmware to all scopes without it, in parallel.
+        :param firmware: (OPTIONAL) The firmware packets to send. Default: custom firmware (either BE or BL).
+        :param timeout: (OPTIONAL) A timeout for each packet transfer on the firmware upload. Default: 60 seconds.
+        :return: True if all scopes came back with the firmware.
+        """
+        scopes = [scope for scope in self.scopes if not scope.is_device_firmware_present]
+        if not scopes:
+            return True
+        with ThreadPoolExecutor(len(scopes)) as executor:
+            futures = [executor.submit(scope.flash_firmware, firmware, timeout=timeout) for scope in scopes]
+            return all([future.result() for future in futures])
+
+    def start(self, callbacks, **kwargs):
+        """
+        Start streaming from all scopes, the events of all transfers are handled by one thread.
+        :param callbacks: One read_async callback per scope, or a single callback which is called with the index of
+                          the scope as first argument.
+        :param kwargs: Further read_async arguments, e.g. data_size or numpy.
+        :return: The list of AsyncReader instances.
+        """
+        if callable(callbacks):
+            callbacks = [lambda *data, index=index: callbacks(index, *data) for index in range(len(self.scopes))]
+        assert len(callbacks) == len(self.scopes)
+        self.call_all('start_capture')
+        self.start_time = time.monotonic()
+        self.start_bytes = [scope.bytes_received for scope in self.scopes]
+        self.readers = [scope.read_async(callback, **kwargs) for scope, callback in zip(self.scopes, callbacks)]
+        self.event_thread.start()
+        return self.readers
+
+    def stop(self):
+        """
+        Stop streaming from all scopes.
+        :return: True if all transfers finished in time.
+        """
+        self.call_all('stop_capture')
+        finished = all([reader.stop(timeout=1) for reader in self.readers])
+        self.event_thread.stop()
+        self.readers = []
+        return finished
+
+    def stats(self):
+        """
+        :return: One dictionary per scope with its port path, throughput in bytes/s since start, and loss counters.
+        """
+        elapsed = time.monotonic() - self.start_time if self.start_time else 0
+        start_bytes = self.start_bytes or [0] * len(self.scopes)
+        return [{'port_path': scope.port_path, 'bytes_received': scope.bytes_received,
+                 'throughput': (scope.bytes_received - received) / elapsed if elapsed else 0.0,
+                 'dropped_blocks': scope.dropped_blocks, 'packets_in_error': scope.packets_in_error,
+                 'samples_lost': scope.samples_lost} for scope, received in zip(self.scopes, start_bytes)]
+
+    def close(self):
+        """
+        Stop streaming and close all scopes.
+        :return: True if successful.
+        """
+        if self.readers:
+            self.stop()
+        for scope in self.scopes:
+            scope.close_handle()
+        self.scopes = []
+        self.registry.close()
+        return True
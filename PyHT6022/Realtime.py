@@ -0,0 +1,101 @@
+import os
+import ctypes
+import numpy as np
+
+# Tuning of the acquisition thread, everything is optional: whatever the platform or the permissions do not allow
+# is skipped and reported, nothing raises.
+
+POLICIES = {'fifo': getattr(os, 'SCHED_FIFO', None), 'rr': getattr(os, 'SCHED_RR', None)}
+
+
+def get_libc():
+    """
+    :return: The C library with errno support, or None if it is not available (e.g. on Windows).
+    """
+    try:
+        return ctypes.CDLL(None, use_errno=True)
+    except (OSError, TypeError):
+        return None
+
+
+def set_affinity(cpus):
+    """
+    Pin the calling thread to some CPUs (Linux only).
+    :param cpus: The CPU numbers.
+    :return: The set of CPUs applied, or None if that is not supported or permitted.
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+    try:
+        # pid 0 is the calling thread
+        os.sched_setaffinity(0, cpus)
+        return os.sched_getaffinity(0)
+    except OSError:
+        return None
+
+
+def set_realtime_priority(priority, policy='fifo'):
+    """
+    Switch the calling thread to a real-time scheduling policy (Linux only, needs CAP_SYS_NICE or an rtprio limit).
+    :param priority: The real-time priority, 1 (lowest) to 99.
+    :param policy: (OPTIONAL) 'fifo' for SCHED_FIFO or 'rr' for SCHED_RR. Default: 'fifo'
+    :return: True if applied, False if not supported or permitted.
+    """
+    if POLICIES.get(policy) is None or not hasattr(os, 'sched_setscheduler'):
+        return False
+    try:
+        os.sched_setscheduler(0, POLICIES[policy], os.sched_param(priority))
+        return True
+    except OSError:
+        return False
+
+
+def get_buffer_address(buffer):
+    """
+    :param buffer: A numpy array or a writable object supporting the buffer protocol.
+    :return: The address and size in bytes of the buffer's memory.
+    """
+    if isinstance(buffer, np.ndarray):
+        return buffer.ctypes.data, buffer.nbytes
+    view = memoryview(buffer).cast('B')
+    return ctypes.addressof(ctypes.c_char.from_buffer(view)), view.nbytes
+
+
+def lock_memory(*buffers):
+    """
+    Lock buffers into RAM with mlock, so accessing them never page faults.
+    :param buffers: Numpy arrays or writable buffers.
+    :return: The number of bytes locked and the number of bytes that could not be locked (e.g. RLIMIT_MEMLOCK).
+    """
+    libc = get_libc()
+    locked = failed = 0
+    for buffer in buffers:
+        try:
+            address, size = get_buffer_address(buffer)
+        except (TypeError, ValueError):
+            # read-only buffers can not be located
+            failed += memoryview(buffer).nbytes
+            continue
+        if libc is not None and hasattr(libc, 'mlock') and \
+                libc.mlock(ctypes.c_void_p(address), ctypes.c_size_t(size)) == 0:
+            locked += size
+        else:
+            failed += size
+    return locked, failed
+
+
+def tune_current_thread(cpus=None, priority=None, policy='fifo'):
+    """
+    Apply the requested tuning to the calling thread.
+    :param cpus: (OPTIONAL) The CPUs to pin the thread to. Default: None (leave it)
+    :param priority: (OPTIONAL) The real-time priority. Default: None (leave the normal scheduling)
+    :param policy: (OPTIONAL) 'fifo' or 'rr'. Default: 'fifo'
+    :return: A dictionary of what was actually applied: 'affinity' (set of CPUs or None) and 'policy' and
+             'priority' (None if the thread still runs with normal scheduling).
+    """
+    report = {'affinity': None, 'policy': None, 'priority': None}
+    if cpus is not None:
+        report['affinity'] = set_affinity(cpus)
+    if priority is not None and set_realtime_priority(priority, policy):
+        report['policy'], report['priority'] = policy, priority
+    return report
@@ -0,0 +1,251 @@
+import threading
+import numpy as np
+
+
+class RingBuffer(object):
+    """
+    A preallocated single producer, multiple reader ring buffer for the samples of both channels.
+    Every channel is kept in a uint8 numpy array of twice the ring size, each sample is written to both halves. This
+    way any window of up to size samples is a contiguous slice, which is handed out without copying.
+    The ring is callable with the arguments of a read_async callback, so it can be passed to read_async directly.
+    """
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+    BLOCK = 'block'
+
+    def __init__(self, size, num_channels=2, policy=DROP_OLDEST, buffer=None):
+        """
+        Create the ring buffer.
+        :param size: The number of samples per channel held by the ring.
+        :param num_channels: (OPTIONAL) The number of channels stored. Default: 2
+        :param policy: (OPTIONAL) What to do when a write would overwrite samples not yet read by all readers:
+                       DROP_OLDEST overwrites them, DROP_NEWEST discards the new samples, BLOCK waits for the
+                       readers. BLOCK would stall the libusb event handling, so a blocking ring must be written from
+                       a thread of its own, e.g. the consumer of stream(), and can not be a read_async callback.
+                       Default: DROP_OLDEST
+        :param buffer: (OPTIONAL) A uint8 array of shape (num_channels, 2 * size) used as storage, e.g. on shared
+                       memory. Default: None (allocate it)
+        """
+        assert policy in (self.DROP_OLDEST, self.DROP_NEWEST, self.BLOCK)
+        self.size = size
+        self.num_channels = num_channels
+        self.policy = policy
+        if buffer is None:
+            buffer = np.zeros((num_channels, 2 * size), dtype=np.uint8)
+        assert buffer.shape == (num_channels, 2 * size) and buffer.dtype == np.uint8
+        self.buffer = buffer
+        self.write_index = 0
+        # samples overwritten before every reader got them (DROP_OLDEST) or discarded on arrival (DROP_NEWEST)
+        self.overwritten = 0
+        self.dropped = 0
+        self.readers = []
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def __call__(self, ch1_data, ch2_data=None, info=None, *_):
+        """
+        Write one block as delivered to a read_async callback. A block lent by read_async (lend=True) is given back
+        once it is copied into the ring, any further arguments are ignored.
+        """
+        assert self.policy != self.BLOCK, "a BLOCK ring would stall the event handling, it can not be a callback"
+        try:
+            self.write(ch1_data, ch2_data)
+        finally:
+            release = getattr(info, 'release', None)
+            if release is not None:
+                release()
+
+    def reader(self):
+        """
+        Create a reader, which starts at the current write position.
+        :return: A RingReader instance.
+        """
+        with self.condition:
+            reader = RingReader(self, self.write_index)
+            self.readers.append(reader)
+        return reader
+
+    def remove_reader(self, reader):
+        """
+        Forget about the reader, it does no longer hold back the writer.
+        :param reader: The reader to remove.
+        :return: None
+        """
+        with self.condition:
+            if reader in self.readers:
+                self.readers.remove(reader)
+            self.condition.notify_all()
+
+    def close(self):
+        """
+        Close the ring, waiting writers and readers return immediately.
+        :return: None
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def free(self):
+        """
+        :return: The number of samples which can be written without overwriting unread samples.
+        """
+        if not self.readers:
+            return self.size
+        return self.size - (self.write_index - min(reader.read_index for reader in self.readers))
+
+    def write(self, ch1_data, ch2_data=None):
+        """
+        Write a block of samples, applying the overflow policy.
+        :param ch1_data: The samples of CH1 (any buffer of uint8, e.g. a numpy array, bytes or array('B')).
+        :param ch2_data: (OPTIONAL) The samples of CH2, ignored if only one channel is stored. If None or empty, as
+                         delivered with one active channel, only CH1 is written. Default: None
+        :return: The number of samples written per channel.
+        """
+        if ch2_data is None or not len(ch2_data):
+            channels = [ch1_data]
+        else:
+            channels = [ch1_data, ch2_data][:self.num_channels]
+        channels = [data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=np.uint8)
+                    for data in channels]
+        count = min(len(data) for data in channels)
+        written = 0
+        while written < count and not self.closed:
+            written += self.write_chunk([data[written:written + self.size] for data in channels])
+        return written
+
+    def write_chunk(self, channels):
+        """
+        Write at most size samples per channel.
+        :param channels: The samples for each channel, all of the same length.
+        :return: The number of samples consumed per channel, including the dropped ones.
+        """
+        count = len(channels[0])
+        with self.condition:
+            if self.policy == self.BLOCK:
+                while self.free() < count and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return count
+            elif self.policy == self.DROP_NEWEST:
+                free = self.free()
+                if free < count:
+                    self.dropped += count - free
+                    channels = [data[:free] for data in channels]
+            else:
+                oldest = self.write_index + count - self.size
+                lost = 0
+                for reader in self.readers:
+                    if reader.read_index < oldest:
+                        reader.overwritten += oldest - reader.read_index
+                        lost = max(lost, oldest - reader.read_index)
+                        reader.read_index = oldest
+                self.overwritten += lost
+            start = self.write_index % self.size
+        # only this producer touches the unpublished part of the ring
+        length = len(channels[0])
+        end = start + length
+        size = self.size
+        for row, data in zip(self.buffer, channels):
+            row[start:end] = data
+            if end <= size:
+                row[start + size:end + size] = data
+            else:
+                row[start + size:] = data[:size - start]
+                row[:end - size] = data[size - start:]
+        with self.condition:
+            self.write_index += length
+            self.condition.notify_all()
+        return count
+
+    def latest(self, count):
+        """
+        Take a window of the newest samples, e.g. for display.
+        :param count: The number of samples per channel, at most size.
+        :return: A zero copy view for each channel, shorter if less samples have been written.
+        """
+        with self.condition:
+            count = min(count, self.size, self.write_index)
+            return self.window(self.write_index - count, count)
+
+    def window(self, index, count):
+        """
+        Take a window of the ring.
+        :param index: The sample index of the first sample, counted from the start of the ring.
+        :param count: The number of samples per channel, at most size.
+        :return: A zero copy view for each channel. The views stay valid until the writer gets there.
+        """
+        assert count <= self.size
+        start = index % self.size
+        return tuple(row[start:start + count] for row in self.buffer)
+
+
+class RingReader(object):
+    """
+    A reader of a RingBuffer, created by RingBuffer.reader. Every reader has its own position.
+    """
+    def __init__(self, ring, read_index):
+        self.ring = ring
+        self.read_index = read_index
+        # samples this reader lost because the writer overwrote them
+        self.overwritten = 0
+
+    def available(self):
+        """
+        :return: The number of samples per channel ready to read.
+        """
+        return self.ring.write_index - self.read_index
+
+    def wait(self, count, timeout=None):
+        """
+        Wait until count samples per channel are ready to read.
+        :param count: The number of samples, at most the size of the ring.
+        :param timeout: (OPTIONAL) The timeout in seconds. Default: None (Wait forever)
+        :return: True if the samples are ready, False on timeout or if the ring was closed.
+        """
+        assert count <= self.ring.size
+        with self.ring.condition:
+            return self.ring.condition.wait_for(lambda: self.available() >= count or self.ring.closed,
+                                                timeout) and self.available() >= count
+
+    def peek(self, count):
+        """
+        Take a window of the next samples without consuming them. The window is protected from the writer with the
+        DROP_NEWEST and BLOCK policies until it is consumed by advance.
+        :param count: The number of samples per channel, at most the number of available samples.
+        :return: A zero copy view for each channel.
+        """
+        with self.ring.condition:
+            assert count <= self.available()
+            return self.ring.window(self.read_index, count)
+
+    def advance(self, count):
+        """
+        Consume samples, which makes room for the writer.
+        :param count: The number of samples per channel.
+        :return: None
+        """
+        with self.ring.condition:
+            self.read_index += min(count, self.available())
+            self.ring.condition.notify_all()
+
+    def read(self, count, timeout=None):
+        """
+        Wait for and consume the next samples.
+        :param count: The number of samples per channel, at most the size of the ring.
+        :param timeout: (OPTIONAL) The timeout in seconds. Default: None (Wait forever)
+        :return: A zero copy view for each channel, or None on timeout. With the DROP_OLDEST policy the views are
+                 overwritten once the writer gets there, copy them if you need to keep the samples.
+        """
+        if not self.wait(count, timeout):
+            return None
+        with self.ring.condition:
+            data = self.ring.window(self.read_index, count)
+            self.advance(count)
+        return data
+
+    def close(self):
+        """
+        Detach the reader from the ring.
+        :return: None
+        """
+        self.ring.remove_reader(self)
@@ -0,0 +1,109 @@
+import numpy as np
+from collections import deque
+
+
+class SampleClock(object):
+    """
+    Recovers the true sample clock of a device against the host's time.monotonic(), from the completion times of
+    the received blocks. The completion of a block comes some latency after its last sample was taken, and that
+    latency varies. So the observations are grouped into intervals, and per interval only the one with the least
+    latency is kept. A straight line is fitted robustly through the kept observations: outliers are rejected
+    iteratively by their median absolute deviation. The line is refined whenever an interval is complete, and
+    time_of / index_at evaluate it in O(1).
+    """
+    def __init__(self, nominal_rate, interval=1.0, history=600, rejection=3.0):
+        """
+        :param nominal_rate: The nominal sample rate in samples/s, see Oscilloscope.SAMPLE_RATES.
+        :param interval: (OPTIONAL) The length of the intervals observations are grouped in, in seconds. Default: 1 s
+        :param history: (OPTIONAL) The number of intervals the fit is based on. Default: 600 (10 minutes)
+        :param rejection: (OPTIONAL) Observations deviating by more than this many MADs are ignored. Default: 3.0
+        """
+        self.interval = interval
+        self.rejection = rejection
+        self.observations = deque(maxlen=history)
+        self.reset(nominal_rate)
+
+    def reset(self, nominal_rate, sample_index=None, timestamp=None):
+        """
+        Forget all observations, e.g. after the sample rate changed.
+        :param nominal_rate: The new nominal sample rate in samples/s.
+        :param sample_index: (OPTIONAL) A sample index to anchor the model at until the first fit. Default: None
+        :param timestamp: (OPTIONAL) The time.monotonic() of that sample. Default: None
+        :return: None
+        """
+        self.nominal_rate = float(nominal_rate)
+        self.rate = self.nominal_rate
+        self.reference_index = sample_index
+        self.reference_time = timestamp
+        self.observations.clear()
+        # the best observation of the current interval
+        self.interval_start = None
+        self.candidate = None
+
+    def add(self, sample_index, timestamp):
+        """
+        Add an observation.
+        :param sample_index: The index following the last sample of a block, e.g. AsyncReader.sample_index.
+        :param timestamp: The time.monotonic() when the block was completed.
+        :return: None
+        """
+        if self.interval_start is None:
+            self.interval_start = timestamp
+        latency = timestamp - sample_index / self.nominal_rate
+        if self.candidate is None or latency < self.candidate[2]:
+            self.candidate = (sample_index, timestamp, latency)
+        if self.reference_index is None:
+            self.reference_index, self.reference_time = sample_index, timestamp
+        if timestamp - self.interval_start >= self.interval:
+            self.observations.append(self.candidate[:2])
+            self.candidate = None
+            self.interval_start = timestamp
+            self.fit()
+
+    def fit(self):
+        """
+        Fit the sample clock through the kept observations.
+        :return: None
+        """
+        if len(self.observations) < 2:
+            self.reference_index, self.reference_time = self.observations[-1]
+            return
+        indexes, times = np.array(self.observations, dtype=np.float64).T
+        # relative values keep the precision for multi-hour captures
+        index0, time0 = indexes[-1], times[-1]
+        indexes -= index0
+        times -= time0
+        keep = np.ones(len(times), dtype=bool)
+        for _ in range(3):
+            slope, intercept = np.polyfit(indexes[keep], times[keep], 1)
+            residuals = times - (slope * indexes + intercept)
+            deviation = np.median(np.abs(residuals[keep] - np.median(residuals[keep])))
+            new_keep = np.abs(residuals) <= self.rejection * max(deviation, 1e-9)
+            if new_keep.sum() < 2 or (new_keep == keep).all():
+                break
+            keep = new_keep
+        # the line goes through the observations with the least latency
+        intercept += np.min(residuals[keep])
+        self.rate = 1.0 / slope
+        self.reference_index = index0
+        self.reference_time = time0 + intercept
+
+    def time_of(self, sample_index):
+        """
+        :param sample_index: A sample index, or a numpy array of them.
+        :return: The time.monotonic() the sample was taken at.
+        """
+        return self.reference_time + (sample_index - self.reference_index) / self.rate
+
+    def index_at(self, timestamp):
+        """
+        :param timestamp: A time.monotonic() value.
+        :return: The (fractional) index of the sample taken at that time.
+        """
+        return self.reference_index + (timestamp - self.reference_time) * self.rate
+
+    def get_drift(self):
+        """
+        :return: The relative deviation of the recovered from the nominal sample rate, e.g. 2e-5 for 20 ppm fast.
+        """
+        return self.rate / self.nominal_rate - 1
@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+import numpy as np
+
+from PyHT6022.Alignment import estimate_offset, estimate_drift, StreamAligner
+
+
+def capture(reference, offset, drift, size):
+    positions = offset + (1 + drift) * np.arange(size)
+    return np.interp(positions, np.arange(len(reference)), reference).astype(np.uint8)
+
+
+class AlignmentTests(TestCase):
+    def setUp(self):
+        noise = np.random.RandomState(6022).standard_normal(0x80000)
+        self.reference = np.convolve(noise, np.ones(16) / 16, 'same') * 60 + 128
+
+    def test_estimate_offset(self):
+        first = capture(self.reference, 1000, 0, 0x8000)
+        second = capture(self.reference, 1500.5, 0, 0x8000)
+        assert abs(estimate_offset(first, second, 0x1000) + 500.5) < 0.5
+
+    def test_estimate_drift(self):
+        first = capture(self.reference, 1000, 0, 0x60000)
+        second = capture(self.reference, 1300, 1e-5, 0x60000)
+        offset, drift = estimate_drift(first, second, window=0x8000)
+        assert abs(offset + 300) < 1
+        assert abs(drift + 1e-5) < 1e-6
+
+    def test_stream_aligner(self):
+        first = capture(self.reference, 1000, 0, 0x60000)
+        second = capture(self.reference, 1300, 1e-5, 0x60000)
+        aligner = StreamAligner(2, num_channels=1, window=0x8000, history=4)
+        aligned = [[], []]
+        for start in range(0, len(first), 5000):
+            aligner.push(0, first[start:start + 5000])
+            aligner.push(1, second[start:start + 5000])
+            for stream, samples in enumerate(aligner.pull()):
+                aligned[stream].append(samples)
+            # only the samples still needed for measuring are buffered
+            assert max(aligner.lengths) < 0x20000
+        assert len(aligner.measurements[1]) == 4
+        first, second = [np.concatenate(samples, axis=1)[0] for samples in aligned]
+        assert len(first) == len(second) > 0x50000
+        assert np.abs(first - second).mean() < 2
+
+    def test_stream_aligner_late_start(self):
+        first = capture(self.reference, 1000, 0, 0x40000)
+        second = capture(self.reference, 4000, 0, 0x40000)
+        aligner = StreamAligner(2, num_channels=1, window=0x8000, max_lag=0x1000)
+        aligned = [[], []]
+        for start in range(0, len(first), 5000):
+            aligner.push(0, first[start:start + 5000])
+            aligner.push(1, second[start:start + 5000])
+            for stream, samples in enumerate(aligner.pull()):
+                aligned[stream].append(samples)
+        first, second = [np.concatenate(samples, axis=1)[0] for samples in aligned]
+        assert len(first) == len(second) > 0x30000
+        # nothing is emitted for the first 3000 samples, which the second stream never saw
+        assert np.abs(first - second).max() < 2
@@ -0,0 +1,24 @@
+import os
+import threading
+from unittest import TestCase
+
+from PyHT6022.Daemon import ScopeDaemon, ScopeClient
+
+
+class DaemonTests(TestCase):
+    def test_daemon_client(self):
+        print("Testing streaming through the capture daemon.")
+        socket_path = '/tmp/ht6022-test-{}.sock'.format(os.getpid())
+        daemon = ScopeDaemon(socket_path, size=0x40000)
+        assert daemon.start()
+        threading.Thread(target=daemon.serve_forever, daemon=True).start()
+        try:
+            client = ScopeClient(socket_path)
+            assert client.set_sample_rate(10)
+            assert client.set_ch1_voltage_range(1)
+            assert client.command('status')['sample_rate_index'] == 10
+            ch1_data, ch2_data = client.read(0x10000, timeout=5)
+            assert len(ch1_data) == len(ch2_data) == 0x10000
+            client.close()
+        finally:
+            assert daemon.shutdown()
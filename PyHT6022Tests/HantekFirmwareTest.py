@@ -0,0 +1,53 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from PyHT6022 import HantekFirmware
+
+
+class HantekFirmwareTests(TestCase):
+    def test_load_firmware_cache(self):
+        firmware_file = HantekFirmware.FIRMWARE_FILES['custom_firmware_BE']
+        packets = HantekFirmware.fx2_ihex_to_control_packets(firmware_file)
+        assert packets[0].value == packets[-1].value == 0xe600
+        with tempfile.TemporaryDirectory() as cache_dir:
+            assert HantekFirmware.load_firmware(firmware_file, cache_dir) == packets
+            assert len(os.listdir(cache_dir)) == 1
+            assert HantekFirmware.load_firmware(firmware_file, cache_dir) == packets
+
+    def test_lazy_attributes(self):
+        with tempfile.TemporaryDirectory() as cache_dir, patch.dict(HantekFirmware.__dict__, CACHE_DIR=cache_dir):
+            for name in ('custom_firmware', 'custom_firmware_BE'):
+                HantekFirmware.__dict__.pop(name, None)
+            assert HantekFirmware.custom_firmware is HantekFirmware.custom_firmware_BE
+            assert len(os.listdir(cache_dir)) == 1
+        assert 'stock_firmware' in dir(HantekFirmware)
+        with self.assertRaises(AttributeError):
+            HantekFirmware.no_such_firmware
+
+    def test_coalesce_control_packets(self):
+        def memory_image(packets):
+            memory = {}
+            for packet in packets:
+                if packet.value != HantekFirmware.CPUCS_ADDRESS:
+                    memory.update(zip(range(packet.value, packet.value + packet.size), packet.data))
+            return memory
+        packets = HantekFirmware.load_firmware(HantekFirmware.FIRMWARE_FILES['custom_firmware_BE'], None)
+        merged = HantekFirmware.coalesce_control_packets(packets)
+        assert len(merged) < len(packets)
+        assert merged[0] == packets[0] and merged[-1] == packets[-1]
+        assert all(packet.size == len(packet.data) <= HantekFirmware.MAX_CONTROL_SIZE for packet in merged)
+        assert memory_image(merged) == memory_image(packets)
+
+    def test_binary_to_ihex_records(self):
+        data = bytes(range(256)) * 4 + b'\x12\x34\x56'
+        lines = HantekFirmware.binary_to_ihex_records(data, 0x100)
+        assert lines[0] == ':10010000000102030405060708090a0b0c0d0e0f77'
+        assert lines[-1].startswith(':03050000123456')
+        with tempfile.TemporaryDirectory() as directory:
+            hex_file = os.path.join(directory, 'dump.hex')
+            with open(hex_file, 'w') as f:
+                f.writelines(line + '\n' for line in lines + [HantekFirmware.IHEX_END_RECORD])
+            packets = HantekFirmware.fx2_ihex_to_control_packets(hex_file)
+        assert b''.join(packet.data for packet in packets[1:-1]) == data
@@ -1,5 +1,8 @@
 __author__ = 'Robert Cope'
 
+import asyncio
+import tempfile
+import numpy as np
 from unittest import TestCase
 
 from PyHT6022.LibUsbScope import Oscilloscope
@@ -28,6 +31,20 @@ class BasicTests(TestCase):
         assert scope.flash_firmware(stock_firmware, supports_single_channel=False)
         assert scope.close_handle()
 
+    def test_device_registry(self):
+        print ("Testing that scopes sharing a registry get different devices.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        registry = scope.get_registry()
+        port_path = scope.get_port_path(scope.device)
+        assert registry.get(port_path).device is scope.device
+        other = Oscilloscope(context=scope.context, registry=registry)
+        if other.setup():
+            assert other.get_port_path(other.device) != port_path
+        assert scope.close_handle()
+        assert other.setup()
+
     def test_get_cal_values(self):
         print ("Testing getting calibration values.")
         scope = Oscilloscope()
@@ -49,6 +66,101 @@ class BasicTests(TestCase):
         assert ch1_data
         assert scope.close_handle()
 
+    def test_read_data_numpy(self):
+        print("Testing reading data from the oscilloscope as numpy views.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        ch1_data, ch2_data = scope.read_data(data_size=0x400, numpy=True)
+        assert len(ch1_data) == len(ch2_data) == 0x400
+        assert ch1_data.base is ch2_data.base
+        assert scope.close_handle()
+
+    def test_read_data_into(self):
+        print("Testing reading data into caller owned buffers.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        reader = scope.build_data_reader_into()
+        buffer = bytearray(0x800)
+        channels = np.zeros((2, 0x400), dtype=np.uint8)
+        assert scope.start_capture()
+        assert reader(buffer) == 0x800
+        assert reader(memoryview(buffer)[:0x400]) == 0x400
+        assert reader(channels) == 0x800
+        assert scope.stop_capture()
+        assert scope.close_handle()
+
+    def test_select_interface(self):
+        print("Testing automatic interface selection.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        scope.set_num_channels(1)
+        scope.set_sample_rate(8)
+        assert scope.select_interface()
+        assert scope.is_iso and scope.interface_alt == 3
+        scope.set_sample_rate(24)
+        assert scope.select_interface()
+        assert scope.is_iso and scope.interface_alt == 1
+        assert scope.close_handle()
+
+    def test_submit_control_while_streaming(self):
+        print("Testing queued control requests during a stream.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        blocks = scope.stream(0x4000, numpy=True)
+        next(blocks)
+        futures = [scope.submit_sample_rate(10), scope.submit_ch1_voltage_range(2),
+                   scope.submit_ch2_voltage_range(5), scope.submit_ch1_ch2_ac_dc(scope.DC_DC)]
+        for _ in range(16):
+            next(blocks)
+        assert all(future.result(timeout=1) for future in futures)
+        assert scope.sample_rate_index == 10
+        blocks.close()
+        assert scope.close_handle()
+
+    def test_config_events(self):
+        print("Testing tagging of configuration changes in a stream.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        assert scope.set_ch1_voltage_range(1)
+        blocks = scope.stream(0x4000, numpy=True, metadata=True)
+        next(blocks)
+        assert scope.set_ch1_voltage_range(5)
+        reader = scope.async_readers[-1]
+        event = reader.config_events[-1]
+        assert event.setting == 'ch1_voltage_range' and event.value == 5
+        assert event.earliest_index <= event.sample_index
+        assert reader.get_setting('ch1_voltage_range', event.sample_index - 1) == 1
+        assert reader.get_setting('ch1_voltage_range', event.sample_index) == 5
+        ch1_data, _, info = next(blocks)
+        assert len(scope.scale_read_data_segments(ch1_data, info.sample_index, reader)) == len(ch1_data)
+        blocks.close()
+        assert scope.close_handle()
+
+    def test_capture(self):
+        print("Testing pipelined capture from the armed oscilloscope.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        for data_size in [0x400, 0x10000, 0x100000]:
+            ch1_data, ch2_data = scope.capture(data_size=data_size, transfer_size=0x4000)
+            assert len(ch1_data) == len(ch2_data) == data_size
+            assert ch1_data.base is ch2_data.base
+        assert scope.armed
+        assert scope.disarm()
+        assert not scope.armed
+        assert scope.close_handle()
+
     def test_read_many_sizes(self):
         print("Testing reading many different data sizes")
         scope = Oscilloscope()
@@ -126,6 +238,147 @@ class BasicTests(TestCase):
         assert not ch2_data
         assert scope.close_handle()
 
+    def test_stream(self):
+        print("Testing streaming blocks from the oscilloscope.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        blocks = 0
+        for ch1_data, ch2_data in scope.stream(0x4000, numpy=True, timeout=5):
+            assert len(ch1_data) == len(ch2_data)
+            blocks += 1
+            if blocks == 10:
+                break
+        assert not scope.event_thread.running
+        assert scope.close_handle()
+
+    def test_stream_metadata(self):
+        print("Testing block metadata and loss counters while streaming.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        next_index = 0
+        for sequence, (ch1_data, _, info) in enumerate(scope.stream(0x4000, numpy=True, timeout=5, metadata=True)):
+            assert info.sequence == sequence
+            assert info.sample_index == next_index
+            next_index += len(ch1_data)
+            if sequence == 10:
+                break
+        assert scope.bytes_received >= next_index * 2
+        assert scope.samples_lost == 0
+        assert scope.close_handle()
+
+    def test_transfer_parameters(self):
+        print("Testing automatic sizing of the async transfers.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        assert scope.set_sample_rate(24)
+        data_size, outstanding_transfers, transfer_time = scope.get_transfer_parameters(0.01, 0.1)
+        assert data_size % scope.packetsize == 0
+        assert outstanding_transfers * transfer_time >= 0.1
+        for ch1_data, _ in scope.stream(timeout=5):
+            assert ch1_data
+            break
+        assert scope.close_handle()
+
+    def test_transfer_parameters_iso_interval(self):
+        print("Testing automatic sizing of the async transfers on an iso interface with bInterval > 1.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        assert scope.set_sample_rate(1)
+        assert scope.set_interface(5)
+        assert scope.is_iso
+        interval = scope.get_packet_interval()
+        assert interval > 125e-6
+        data_size, outstanding_transfers, transfer_time = scope.get_transfer_parameters(0.01, 0.1)
+        assert transfer_time == data_size // scope.packetsize * interval
+        assert 0.01 <= transfer_time < 0.01 + interval
+        assert outstanding_transfers * transfer_time >= 0.1
+        assert scope.close_handle()
+
+    def test_read_async_lend(self):
+        print("Testing zero-copy delivery of pooled buffers.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        blocks = []
+
+        def callback(ch1_data, ch2_data, info):
+            blocks.append(info)
+            info.release()
+
+        scope.start_capture()
+        reader = scope.read_async(callback, 0x4000, numpy=True, lend=True)
+        while len(blocks) < 20:
+            scope.poll()
+        scope.stop_capture()
+        assert reader.stop(timeout=1)
+        assert reader.pool.allocated == len(reader.pool.free) + len(reader.transfers)
+        assert scope.close_handle()
+
+    def test_read_async_callback_errors(self):
+        print("Testing that failing callbacks do not stop the async read.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        errors = []
+
+        def callback(ch1_data, ch2_data):
+            raise ValueError("consumer failed")
+
+        scope.start_capture()
+        reader = scope.read_async(callback, 0x4000, raw=True, error_callback=errors.append)
+        while reader.errors < 20:
+            scope.poll()
+        scope.stop_capture()
+        assert reader.stop(timeout=1)
+        assert len(errors) >= 20
+        assert isinstance(reader.last_exception, ValueError)
+        assert scope.close_handle()
+
+    def test_read_async_stop(self):
+        print("Testing stopping and restarting async reads.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+        for _ in range(5):
+            blocks = []
+            scope.start_capture()
+            reader = scope.read_async(lambda ch1_data, ch2_data: blocks.append(ch1_data), 0x4000, raw=True)
+            while len(blocks) < 5:
+                scope.poll()
+            scope.stop_capture()
+            assert reader.stop(timeout=1)
+            assert not any(transfer.isSubmitted() for transfer in reader.transfers)
+        assert scope.close_handle()
+
+    def test_astream(self):
+        print("Testing streaming blocks from the oscilloscope with asyncio.")
+        scope = Oscilloscope()
+        assert scope.setup()
+        assert scope.open_handle()
+        assert scope.flash_firmware()
+
+        async def capture():
+            assert await scope.aset_sample_rate(1)
+            blocks = scope.astream(0x4000, raw=True)
+            async for ch1_data, ch2_data in blocks:
+                assert ch1_data
+                break
+            await blocks.aclose()
+
+        asyncio.run(capture())
+        assert scope.close_handle()
+
     def test_read_firmware(self):
         print("Testing read_firmware method on scope.")
         scope = Oscilloscope()
@@ -133,6 +386,12 @@ class BasicTests(TestCase):
         assert scope.open_handle()
         assert scope.flash_firmware()
         assert scope.read_firmware()
+        raw = scope.read_firmware(length=5000, to_ihex=False)
+        assert len(raw) == 5000
+        with tempfile.TemporaryFile('w+') as f:
+            assert scope.read_firmware(output=f)
+            f.seek(0)
+            assert f.read().endswith(":00000001ff\n")
         assert scope.close_handle()
 
     def test_clear_fifo(self):
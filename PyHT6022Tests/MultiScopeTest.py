@@ -0,0 +1,25 @@
+import time
+from unittest import TestCase
+
+from PyHT6022.MultiScope import MultiScope
+
+
+class MultiScopeTests(TestCase):
+    def test_stream_all(self):
+        print("Testing streaming from all attached scopes.")
+        scopes = MultiScope()
+        infos = scopes.enumerate()
+        assert infos
+        assert len(scopes.open([info.port_path for info in infos])) == len(infos)
+        assert scopes.flash_all()
+        assert all(scopes.call_all('set_sample_rate', 10))
+        blocks = [0] * len(infos)
+
+        def callback(index, ch1_data, ch2_data):
+            blocks[index] += 1
+        scopes.start(callback, numpy=True)
+        time.sleep(1)
+        assert scopes.stop()
+        assert all(blocks)
+        assert all(stats['bytes_received'] for stats in scopes.stats())
+        assert scopes.close()
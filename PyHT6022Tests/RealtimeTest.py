@@ -0,0 +1,34 @@
+import os
+import threading
+from unittest import TestCase
+
+import numpy as np
+
+from PyHT6022.Realtime import tune_current_thread, lock_memory
+
+
+def tune_other_thread(**tuning):
+    # the tuning sticks to the thread, so it is applied to a short-lived one and not to the test runner
+    reports = []
+    thread = threading.Thread(target=lambda: reports.append(tune_current_thread(**tuning)))
+    thread.start()
+    thread.join()
+    return reports[0]
+
+
+class RealtimeTests(TestCase):
+    def test_tune_current_thread(self):
+        cpus = sorted(os.sched_getaffinity(0))[:1] if hasattr(os, 'sched_getaffinity') else [0]
+        report = tune_other_thread(cpus=cpus, priority=None)
+        assert report['affinity'] in (None, set(cpus))
+        assert report['policy'] is None and report['priority'] is None
+
+    def test_realtime_priority_falls_back(self):
+        report = tune_other_thread(priority=10, policy='rr')
+        assert report['priority'] in (None, 10)
+
+    def test_lock_memory(self):
+        buffers = [np.zeros(0x1000, dtype=np.uint8), bytearray(0x1000), b'\x00' * 0x1000]
+        locked, failed = lock_memory(*buffers)
+        assert locked + failed == 0x3000
+        assert failed >= 0x1000
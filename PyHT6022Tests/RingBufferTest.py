@@ -0,0 +1,75 @@
+import threading
+from types import SimpleNamespace
+from unittest import TestCase
+
+import numpy as np
+
+from PyHT6022.RingBuffer import RingBuffer
+
+
+class RingBufferTests(TestCase):
+    def test_windows_are_contiguous(self):
+        ring = RingBuffer(10)
+        reader = ring.reader()
+        ring(np.arange(7, dtype=np.uint8), np.arange(100, 107, dtype=np.uint8))
+        assert reader.read(7) is not None
+        ring(np.arange(7, 15, dtype=np.uint8), np.arange(107, 115, dtype=np.uint8), None)
+        ch1, ch2 = reader.read(8)
+        assert list(ch1) == list(range(7, 15))
+        assert list(ch2) == list(range(107, 115))
+        assert ch1.base is ring.buffer
+        ch1, _ = ring.latest(10)
+        assert list(ch1) == list(range(5, 15))
+
+    def test_drop_oldest(self):
+        ring = RingBuffer(8, num_channels=1)
+        reader = ring.reader()
+        ring.write(bytes(range(20)))
+        assert ring.overwritten == 12
+        assert reader.overwritten == 12
+        assert reader.available() == 8
+        ch1, = reader.read(8)
+        assert list(ch1) == list(range(12, 20))
+
+    def test_drop_newest(self):
+        ring = RingBuffer(8, num_channels=1, policy=RingBuffer.DROP_NEWEST)
+        reader = ring.reader()
+        assert ring.write(bytes(range(12))) == 12
+        assert ring.dropped == 4
+        ch1, = reader.read(8)
+        assert list(ch1) == list(range(8))
+
+    def test_block(self):
+        ring = RingBuffer(8, num_channels=1, policy=RingBuffer.BLOCK)
+        reader = ring.reader()
+        writer = threading.Thread(target=ring.write, args=(bytes(range(24)),))
+        writer.start()
+        received = []
+        for _ in range(6):
+            received.extend(reader.read(4, timeout=1)[0])
+        writer.join(timeout=1)
+        assert received == list(range(24))
+        assert ring.overwritten == ring.dropped == 0
+        # blocking in a read_async callback would stall the event handling
+        with self.assertRaises(AssertionError):
+            ring(b'\x00')
+
+    def test_timeout_and_close(self):
+        ring = RingBuffer(8)
+        reader = ring.reader()
+        assert reader.read(4, timeout=0.01) is None
+        ring.close()
+        assert not reader.wait(4)
+
+    def test_lent_blocks_and_one_channel(self):
+        released = []
+        # stands in for the BlockInfo of a lent block
+        info = SimpleNamespace(release=lambda: released.append(True))
+        ring = RingBuffer(8)
+        reader = ring.reader()
+        ring(b'\x01\x02\x03\x04', b'', info)
+        assert released == [True]
+        ch1, _ = reader.read(4)
+        assert list(ch1) == [1, 2, 3, 4]
+        ring(np.arange(3, dtype=np.uint8), np.empty(0, dtype=np.uint8), [3])
+        assert reader.available() == 3
@@ -0,0 +1,26 @@
+from unittest import TestCase
+
+import numpy as np
+
+from PyHT6022.Timing import SampleClock
+
+
+class SampleClockTests(TestCase):
+    def test_recovers_rate_and_time(self):
+        random = np.random.RandomState(6022)
+        rate, start_time = 1e6 * (1 + 3e-5), 1000.0
+        clock = SampleClock(1e6, interval=0.5, history=100)
+        sample_index = 0
+        for _ in range(20000):
+            sample_index += 0x1000
+            latency = 2e-4 + random.exponential(5e-4) + (0.02 if random.rand() < 0.01 else 0)
+            clock.add(sample_index, start_time + sample_index / rate + latency)
+        assert abs(clock.get_drift() - 3e-5) < 1e-6
+        # only the constant part of the latency remains
+        assert abs(clock.time_of(sample_index) - (start_time + sample_index / rate) - 2e-4) < 5e-5
+        assert abs(clock.index_at(clock.time_of(12345)) - 12345) < 1e-3
+
+    def test_nominal_rate_before_fit(self):
+        clock = SampleClock(1e6)
+        clock.add(1000, 5.0)
+        assert clock.time_of(2000) == 5.0 + 1e-3
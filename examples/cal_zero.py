@@ -15,7 +15,7 @@ import binascii
 
 
 # average over 100ms @ 100kS/s -> 5 cycles @ 50 Hz or 6 cycles @ 60 Hz to cancel AC hum
-def read_avg( voltage_range, sample_rate=110, repeat = 1, samples = 12 * 1024 ):
+def read_avg( voltage_range, sample_rate=110, repeat = 1, samples = 10000 ):
     scope.set_sample_rate( sample_rate )
     scope.set_ch1_voltage_range(voltage_range)
     scope.set_ch2_voltage_range(voltage_range)
@@ -27,18 +27,16 @@ def read_avg( voltage_range, sample_rate=110, repeat = 1, samples = 12 * 1024 ):
     count2 = 0
 
     for rep in range( repeat ): # repeat measurement
-        ch1_data, ch2_data = scope.read_data( samples, raw=True, timeout=0)
-
-        # skip first samples and keep 10000
-        skip = samples - 10000
+        # the armed capture already skips the stale and settling samples
+        ch1_data, ch2_data = scope.capture( samples )
 
         # print( len( ch1_data), len( ch2_data ) )
 
-        for sample in ch1_data[skip:]:
+        for sample in ch1_data:
             sum1 += sample
             count1 += 1
 
-        for sample in ch2_data[skip:]:
+        for sample in ch2_data:
             sum2 += sample
             count2 += 1
 
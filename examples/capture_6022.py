@@ -175,6 +175,8 @@ start_time = time.time() + scope.packetsize / sample_rate # correct the 1st skip
 # GO!
 scope.start_capture()
 shutdown_event = scope.read_async( pcb, scope.packetsize, outstanding_transfers=10, raw=True)
+# the transfers are handled on the event thread meanwhile
+scope.start_event_thread()
 
 # sample until time is over, show the progress
 lastsec = None
@@ -191,14 +193,13 @@ while True:
             sys.stderr.write( "\rCapturing ...              " )
         lastsec = int( to_go )
         outfile.flush()
-    scope.poll()
+    time.sleep(0.01)
 
 # STOP!
 scope.stop_capture()
-shutdown_event.set()
-
-# fetch remaining packets before closing the scope (max 1024 * 50µs = 0.0512 s)
-time.sleep(0.1)
+# cancel the remaining transfers before closing the scope
+shutdown_event.stop()
+scope.stop_event_thread()
 scope.close_handle()
 
 if downsample: # calculate the effective sample rate
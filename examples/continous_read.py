@@ -38,36 +38,28 @@ scope = Oscilloscope()
 scope.setup()
 scope.open_handle()
 scope.flash_firmware()
-scope.set_interface(1) # choose ISO
 scope.set_num_channels(1)
 scope.set_sample_rate(sample_rate_index)
+scope.select_interface() # ISO if it sustains the sample rate, BULK otherwise
+print("ISO" if scope.is_iso else "BULK", "interface", scope.interface_alt)
 scope.set_ch1_voltage_range(voltage_range)
 time.sleep(1)
 
 data = deque(maxlen=2*1024*1024)
 data_extend = data.extend
 
-
-def extend_callback(ch1_data, _):
-    global data_extend
-    data_extend(ch1_data)
-
 start_time = time.time()
 print("Clearing FIFO and starting data transfer...")
-i = 0
-scope.start_capture()
-shutdown_event = scope.read_async(extend_callback, data_points, outstanding_transfers=10, raw=True)
-while time.time() - start_time < 1:
-    scope.poll()
-scope.stop_capture()
-print("Stopping new transfers.")
-shutdown_event.set()
-print("Snooze 1")
-time.sleep(1)
+for ch1_data, _ in scope.stream(data_points, outstanding_transfers=10, raw=True):
+    data_extend(ch1_data)
+    if time.time() - start_time >= 1:
+        break
+print("Stopped data transfer.")
 print("Closing handle")
 scope.close_handle()
 print("Handle closed.")
 print("Points in buffer:", len(data))
+print("Samples lost:", scope.samples_lost, "Packets in error:", scope.packets_in_error)
 scaled_data = scope.scale_read_data(data, voltage_range)
 with open('/tmp/continuous_read.out','wt') as ouf:
     ouf.write(str(scaled_data[:65536])[1:-1].replace(', ',chr(10)))
@@ -56,6 +56,17 @@ for sample_rate_index in [0x30, 0x10, 0x08, 0x04, 0x01, 0x32, 0x14, 0x0A]:
             times_append(time_fxn())
         print("List Conversion, Data Points: 0x{:x}".format(data_points))
         print_report(times, data_points)
+
+        reader_fxn = scope.build_data_reader_into()
+        buffer = bytearray(data_points)
+        times = []
+        times_append = times.append
+        times_append(time_fxn())
+        for _ in range(iterations):
+            reader_fxn(buffer)
+            times_append(time_fxn())
+        print("Into Buffer, Data Points: 0x{:x}".format(data_points))
+        print_report(times, data_points)
     print("-"*40)
     print()
 
@@ -164,6 +164,8 @@ def read_scope_data():
 	scope.start_capture()
 	#shutdown_event = scope.read_async(extend_callback, blocksize, outstanding_transfers=10,raw=True)
 	shutdown_event = scope.read_async(extend_callback, blocksize, outstanding_transfers=10)
+	# the transfers are handled on the event thread meanwhile
+	scope.start_event_thread()
 	real_duration = 0
 	while True:
 		if paused:
@@ -173,14 +175,14 @@ def read_scope_data():
 			print("real_duration:",real_duration)
 			if numseconds > 0 and real_duration >= numseconds:
 				break
-			scope.poll()
+			time.sleep(0.1)
 
 	print("Stopping new transfers at {} seconds".format(real_duration))
 
 	#scope.stop_capture()
-	shutdown_event.set()
-	time.sleep(1)
 	scope.stop_capture()
+	shutdown_event.stop()
+	scope.stop_event_thread()
 	scope.close_handle()
 
 	total = sum(len(block[0]['raw']) for block in data)
@@ -57,13 +57,15 @@ start_time = time.time()
 print("Clearing FIFO and starting data transfer...")
 scope.start_capture()
 shutdown_event = scope.read_async(extend_callback, blocksize, outstanding_transfers=10,raw=True)
+# the transfers are handled on the event thread meanwhile
+scope.start_event_thread()
 while time.time() - start_time < numseconds:
-    scope.poll()
+    time.sleep(0.01)
 print("Stopping new transfers.")
 #scope.stop_capture()
-shutdown_event.set()
-time.sleep(1)
 scope.stop_capture()
+shutdown_event.stop()
+scope.stop_event_thread()
 scope.close_handle()
 
 total = sum(len(block) for block in data)
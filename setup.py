@@ -17,4 +17,5 @@ setup(name='Python Hantek 6022BE Wrapper',
                                  os.path.join('HantekFirmware', 'modded', 'mod_fw_iso.ihex'),
                                  os.path.join('HantekFirmware', 'stock', 'stock_fw.ihex'),]},
       include_package_data=True,
-      install_requires=['libusb1'])
+      install_requires=['libusb1', 'numpy'],
+      entry_points={'console_scripts': ['ht6022-daemon = PyHT6022.Daemon:main']})